@@ -0,0 +1,23 @@
+# QuestDB table schema for the sensor data written by mqtt_ingestor.py and read by main.py
+OLIMEX_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS olimex_data (
+    ts TIMESTAMP,
+    device_id SYMBOL,
+    heat_exchanger_efficiency DOUBLE,
+    run_mode INT,
+    outdoor_temp DOUBLE,
+    supply_air_temp DOUBLE,
+    supply_air_setpoint_temp DOUBLE,
+    exhaust_air_temp DOUBLE,
+    extract_air_temp DOUBLE,
+    supply_air_pressure DOUBLE,
+    extract_air_pressure DOUBLE,
+    supply_air_flow DOUBLE,
+    extract_air_flow DOUBLE,
+    extra_supply_air_flow DOUBLE,
+    extra_extract_air_flow DOUBLE,
+    supply_air_fan_runtime LONG,
+    extract_air_fan_runtime LONG
+) TIMESTAMP(ts)
+PARTITION BY DAY;
+"""
@@ -1,7 +1,20 @@
+import atexit
 import logging
+import queue
 import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque
 import psycopg2
 from psycopg2 import OperationalError
+from psycopg2.extras import execute_values
+
+try:
+    # Optional: QuestDB's native ILP client. Without it, logs are written over the PG wire.
+    from questdb.ingress import Sender, TimestampNanos
+except ImportError:
+    Sender = None
+    TimestampNanos = None
 
 # Define the QuestDB table schema for persistent logging
 LOGGING_TABLE_SCHEMA = """
@@ -37,14 +50,48 @@ def create_logging_table(db_config: dict):
 class QuestDBHandler(logging.Handler):
     """
     A custom logging handler that sends log records to QuestDB.
+
+    Records are buffered in memory and written by a background thread in
+    batches, so logging never pays a database round-trip per record and
+    emit() never commits. Batches go over ILP (InfluxDB Line Protocol) when
+    the questdb client package is installed, otherwise as multi-row INSERT
+    statements (execute_values) and one commit over the PG wire.
     """
+    # Seconds between background flushes of the buffer
+    FLUSH_INTERVAL = 0.5
+    # Number of buffered records that triggers an immediate flush
+    FLUSH_THRESHOLD = 1000
+    # Rows per multi-row INSERT sent by execute_values
+    BATCH_PAGE_SIZE = 500
+    # Maximum buffered records; the oldest are dropped beyond this (e.g. during a DB outage)
+    BUFFER_SIZE = 10_000
+    # QuestDB ILP/TCP port (see docker-compose.yml)
+    ILP_PORT = 9009
+
+    # execute_values expands VALUES %s into one multi-row INSERT, rendering each row
+    # with INSERT_TEMPLATE (::TIMESTAMP cast and %s placeholders for psycopg2 compatibility).
+    INSERT_SQL = "INSERT INTO logging(ts, level, logger, message) VALUES %s"
+    INSERT_TEMPLATE = "(%s::TIMESTAMP, %s, %s, %s)"
+
     def __init__(self, db_config: dict, level=logging.NOTSET):
         super().__init__(level)
         self.db_config = db_config
         self.conn = None
         self.cursor = None
+        self.sender = None
         self.logger_name = logging.getLogger(__name__).name # Use internal logger for handler messages
-        self._connect()
+        self._buffer = deque(maxlen=self.BUFFER_SIZE)
+        self._buffer_lock = threading.Lock()
+        self.dropped = 0 # Records discarded (buffer full, rejected by QuestDB or unsent at close)
+        # Serializes use of the connection between the flusher thread and explicit flush() calls
+        self._write_lock = threading.Lock()
+        self._stopped = threading.Event()
+        # Set by emit() to make the flusher write before FLUSH_INTERVAL has passed
+        self._flush_requested = threading.Event()
+        # No connection is opened here: the first flush connects from the flusher
+        # thread, so configuring logging never blocks on QuestDB at import time.
+        self._flusher = threading.Thread(target=self._flush_loop, name="QuestDBHandler-flush", daemon=True)
+        self._flusher.start()
 
     def _connect(self):
         """ Establish and store a database connection for the handler. """
@@ -68,47 +115,208 @@ class QuestDBHandler(logging.Handler):
 
     def emit(self, record):
         """
-        Emit a record by inserting it into the QuestDB 'logging' table.
-        
-        Uses casting (::TIMESTAMP) and %s placeholders for psycopg2 compatibility.
+        Queue a record for insertion into the QuestDB 'logging' table.
+        """
+        # ts (timestamp) must be in microseconds for QuestDB; record.created already
+        # includes the milliseconds (record.msecs is only a formatting helper)
+        ts_microseconds = int(record.created * 1_000_000)
+        row = (ts_microseconds, record.levelname, record.name, record.getMessage())
+
+        with self._buffer_lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1 # append() below evicts the oldest record
+            self._buffer.append(row)
+            pending = len(self._buffer)
+
+        if pending >= self.FLUSH_THRESHOLD:
+            self._flush_requested.set()
+
+    def flush(self):
+        """
+        Write all buffered records to QuestDB in a single batch.
+
+        Returns False if QuestDB could not be reached; the records are then kept
+        in the buffer for the next attempt.
+        """
+        with self._buffer_lock:
+            if not self._buffer:
+                return True
+            rows = list(self._buffer)
+            self._buffer.clear()
+
+        with self._write_lock:
+            if Sender is not None:
+                unsent = self._write_ilp(rows)
+            else:
+                unsent = self._write_pg(rows)
+
+        if unsent:
+            self._requeue(unsent)
+            return False
+        return True
+
+    def _requeue(self, rows):
+        """ Put records that could not be written back in front of any newer ones. """
+        with self._buffer_lock:
+            newer = list(self._buffer)
+            self._buffer.clear()
+            # extend() on the bounded deque evicts from the left, i.e. the oldest records
+            self._buffer.extend(rows)
+            self._buffer.extend(newer)
+            self.dropped += len(rows) + len(newer) - len(self._buffer)
+
+    def _count_dropped(self, count):
+        with self._buffer_lock:
+            self.dropped += count
+
+    def _write_ilp(self, rows):
+        """
+        Send rows over ILP: a pure append with no SQL parsing or per-row acknowledgement.
+        Returns the rows to retry if QuestDB could not be reached.
+        """
+        accepted = []
+        pending = rows # Rows to retry if the send fails
+        try:
+            if self.sender is None:
+                self.sender = Sender.from_conf(f"tcp::addr={self.db_config['host']}:{self.ILP_PORT};")
+                self.sender.establish()
+            for row in rows:
+                ts_microseconds, level, logger_name, message = row
+                try:
+                    # level/logger are plain columns, not symbols: the table declares them as STRING
+                    self.sender.row(
+                        'logging',
+                        columns={'level': level, 'logger': logger_name, 'message': message},
+                        at=TimestampNanos(ts_microseconds * 1000)
+                    )
+                except Exception as e:
+                    # A rejected record is dropped on its own; the rest of the batch is still sent
+                    sys.stderr.write(f"[{self.logger_name}] ERROR encoding log record for ILP: {e}\n")
+                    self._count_dropped(1)
+                    continue
+                accepted.append(row)
+            pending = accepted
+            self.sender.flush()
+        except Exception as e:
+            sys.stderr.write(f"[{self.logger_name}] ERROR sending {len(rows)} log records to QuestDB over ILP: {e}\n")
+            self._close_sender() # Reconnect on the next batch
+            return pending
+        return []
+
+    def _close_sender(self):
+        if self.sender is not None:
+            try:
+                self.sender.close(flush=False)
+            except Exception:
+                pass
+            self.sender = None
+
+    def _write_pg(self, rows):
+        """
+        Insert rows over the PG wire as multi-row INSERTs and one commit.
+        Returns the rows to retry if QuestDB could not be reached.
         """
         # Ensure we have a valid connection before attempting to write
         if not self.conn or self.conn.closed or not self.cursor:
             self._connect() # Attempt to reconnect
             if not self.conn:
-                return # Give up if reconnection fails
-        
-        # ts (timestamp) must be in microseconds for QuestDB
-        ts_microseconds = int(record.created * 1_000_000) + record.msecs * 1000
-        
-        # --- KORRIGERET SQL HER: Bruger %s pladsholdere ---
-        insert_sql = """
-        INSERT INTO logging(ts, level, logger, message)
-        VALUES (%s::TIMESTAMP, %s, %s, %s)
-        """
-        
+                return rows # Keep the batch until QuestDB is reachable again
+
         try:
-            # Rækkefølgen af parametre svarer til %s i insert_sql
-            self.cursor.execute(insert_sql, (
-                ts_microseconds,
-                record.levelname,
-                record.name,
-                record.message
-            ))
+            execute_values(self.cursor, self.INSERT_SQL, rows, template=self.INSERT_TEMPLATE, page_size=self.BATCH_PAGE_SIZE)
             self.conn.commit()
+        except OperationalError as e:
+            # Connection lost mid-write: nothing was committed, so the batch is retried
+            sys.stderr.write(f"[{self.logger_name}] ERROR writing {len(rows)} log records to QuestDB, will retry: {e}\n")
+            self._connect() # Attempt to reconnect for the next batch
+            return rows
         except Exception as e:
-            # Fallback to console if DB writing fails mid-operation
-            sys.stderr.write(f"[{self.logger_name}] ERROR writing log to QuestDB: {e}. Log: {record.message}\n")
+            # The server rejected the batch itself; retrying would fail the same way
+            sys.stderr.write(f"[{self.logger_name}] ERROR writing {len(rows)} log records to QuestDB, dropping them: {e}\n")
+            self._count_dropped(len(rows))
             if self.conn:
                 self.conn.rollback() # Rollback the failed transaction
-            self._connect() # Attempt to reconnect for the next log entry
+        return []
+
+    def _flush_loop(self):
+        """ Background loop flushing the buffer every FLUSH_INTERVAL seconds or on request. """
+        while not self._stopped.is_set():
+            self._flush_requested.wait(self.FLUSH_INTERVAL)
+            self._flush_requested.clear()
+            if not self.flush():
+                # QuestDB is unreachable: wait a full interval before reconnecting,
+                # even if emit() keeps requesting flushes
+                self._stopped.wait(self.FLUSH_INTERVAL)
+
+    def close(self):
+        """
+        Stop the flusher thread, write any remaining records and close the connection.
+        """
+        self._stopped.set()
+        self._flush_requested.set()
+        self._flusher.join(timeout=self.FLUSH_INTERVAL * 2)
+        if not self.flush():
+            with self._buffer_lock:
+                unsent = len(self._buffer)
+                self.dropped += unsent
+                self._buffer.clear()
+            sys.stderr.write(f"[{self.logger_name}] WARNING: {unsent} log records could not be written to QuestDB before shutdown.\n")
+        with self._write_lock:
+            self._close_sender()
+            if self.conn and not self.conn.closed:
+                self.cursor.close()
+                self.conn.close()
+            self.conn = None
+            self.cursor = None
+        super().close()
+
+class DropOldestQueueHandler(QueueHandler):
+    """
+    QueueHandler for a bounded queue: when the queue is full the oldest
+    queued record is discarded to make room for the new one.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0 # Records discarded because the queue was full
+
+    def enqueue(self, record):
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class _LogQueueListener(QueueListener):
+    """ QueueListener that waits for room for its stop sentinel in a bounded queue. """
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+# Maximum number of records waiting for the queue listener
+LOG_QUEUE_SIZE = 10_000
+
+# Handlers and listener set up by configure_logging
+_queue_handler = None
+_db_handler = None
+_queue_listener = None
 
 # Dette er nu en selvstændig funktion, som den skal være
 def configure_logging(db_config: dict):
     """
     Configure structured logging for the FastAPI backend,
     attaching both StreamHandler and QuestDBHandler.
+
+    The root logger only gets a QueueHandler, so a log call is an in-memory
+    enqueue; a QueueListener thread passes the records on to the console and
+    QuestDB handlers.
     """
+    global _queue_handler, _db_handler, _queue_listener
     root = logging.getLogger()
     
     # CRITICAL: Prevent setting up logging multiple times, which duplicates logs.
@@ -121,13 +329,21 @@ def configure_logging(db_config: dict):
     datefmt = "%Y-%m-%d %H:%M:%S"
     formatter = logging.Formatter(fmt=fmt, datefmt=datefmt)
     handler.setFormatter(formatter)
-    root.addHandler(handler)
     
     # 2. QuestDB Handler (Custom persistence)
     db_handler = QuestDBHandler(db_config)
     # We attach the stream formatter to the DB handler for consistency
     db_handler.setFormatter(formatter) 
-    root.addHandler(db_handler)
+
+    # 3. Queue Handler (the only handler on the root logger), bounded so a
+    #    stalled handler cannot grow memory without limit
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = DropOldestQueueHandler(log_queue)
+    _db_handler = db_handler
+    root.addHandler(_queue_handler)
+    _queue_listener = _LogQueueListener(log_queue, handler, db_handler, respect_handler_level=True)
+    _queue_listener.start()
+    atexit.register(stop_logging)
 
     # Set the base logging level (e.g., INFO, DEBUG, WARNING)
     root.setLevel(logging.INFO)
@@ -139,3 +355,25 @@ def configure_logging(db_config: dict):
 
     # Log successful configuration using the configured logger
     logging.getLogger(__name__).info("Custom logging initialized with SPDLog style format and QuestDB persistence.")
+
+
+def stop_logging():
+    """
+    Stop the queue listener after it has passed on all queued records.
+    """
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+
+def get_dropped_log_count() -> int:
+    """
+    Number of log records discarded by the bounded log queue and QuestDB buffer.
+    """
+    dropped = 0
+    if _queue_handler is not None:
+        dropped += _queue_handler.dropped
+    if _db_handler is not None:
+        dropped += _db_handler.dropped
+    return dropped
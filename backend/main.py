@@ -1,6 +1,11 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+import orjson
 import psycopg2
+import psycopg2.pool
+import threading
+import time
 from pydantic import BaseModel
 from datetime import datetime
 from contextlib import contextmanager
@@ -10,7 +15,8 @@ from contextlib import contextmanager
 # =======================
 import logging
 # VIGTIGT: Importer nu configure_logging som en funktion fra modulet
-from .logging_config import configure_logging, create_logging_table, OperationalError
+from .logging_config import configure_logging, stop_logging, get_dropped_log_count, LOGGING_TABLE_SCHEMA, OperationalError
+from .db_schema import OLIMEX_TABLE_SCHEMA
 
 # Database connection details for QuestDB
 DB_CONFIG = {
@@ -21,6 +27,15 @@ DB_CONFIG = {
     "port": 8812        # QuestDB Postgres port
 }
 
+# Connection pool limits for API queries. psycopg2's pool only keeps POOL_MIN_CONN
+# idle connections and closes any others when they are returned, so this is also
+# the number of concurrent requests that can run without opening a new connection.
+POOL_MIN_CONN = 4
+POOL_MAX_CONN = 16
+
+# Seconds the /api/devices result is served from memory before re-querying
+DEVICES_CACHE_TTL = 30
+
 # Kald logningskonfigurationen FØR applikationen starter
 try:
     configure_logging(DB_CONFIG)
@@ -30,7 +45,16 @@ except OperationalError:
 
 logger = logging.getLogger(__name__) # Opret en logger til dette modul
 
-app = FastAPI()
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson (C implementation, serializes datetime natively).
+    """
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS middleware to allow frontend access
 app.add_middleware(
@@ -45,28 +69,65 @@ app.add_middleware(
 # METRIC DEFINITIONS
 # =======================
 
+# (column, unit, kind) - kind "f" for DOUBLE columns, "i" for INT/LONG columns
 METRIC_DEFS = [
-    ("heat_exchanger_efficiency", "%"),
-    ("run_mode", "mode"),
+    ("heat_exchanger_efficiency", "%", "f"),
+    ("run_mode", "mode", "i"),
 
-    ("outdoor_temp", "°C"),
-    ("supply_air_temp", "°C"),
-    ("supply_air_setpoint_temp", "°C"),
-    ("exhaust_air_temp", "°C"),
-    ("extract_air_temp", "°C"),
+    ("outdoor_temp", "°C", "f"),
+    ("supply_air_temp", "°C", "f"),
+    ("supply_air_setpoint_temp", "°C", "f"),
+    ("exhaust_air_temp", "°C", "f"),
+    ("extract_air_temp", "°C", "f"),
 
-    ("supply_air_pressure", "Pa"),
-    ("extract_air_pressure", "Pa"),
+    ("supply_air_pressure", "Pa", "f"),
+    ("extract_air_pressure", "Pa", "f"),
 
-    ("supply_air_flow", "m³/h"),
-    ("extract_air_flow", "m³/h"),
-    ("extra_supply_air_flow", "m³/h"),
-    ("extra_extract_air_flow", "m³/h"),
+    ("supply_air_flow", "m³/h", "f"),
+    ("extract_air_flow", "m³/h", "f"),
+    ("extra_supply_air_flow", "m³/h", "f"),
+    ("extra_extract_air_flow", "m³/h", "f"),
 
-    ("supply_air_fan_runtime", "min"),
-    ("extract_air_fan_runtime", "min"),
+    ("supply_air_fan_runtime", "min", "i"),
+    ("extract_air_fan_runtime", "min", "i"),
 ]
 
+_METRIC_NAMES = tuple(name for name, _, _ in METRIC_DEFS)
+_METRIC_COUNT = len(METRIC_DEFS)
+
+# One prefilled dict per metric, copied and completed by row_to_metrics
+_METRIC_TEMPLATES = tuple(
+    {"metric_name": name, "metric_value": None, "unit": unit, "timestamp": None}
+    for name, unit, _ in METRIC_DEFS
+)
+# Integer columns are emitted as-is instead of being coerced to float
+_METRIC_IS_INT = tuple(kind == "i" for _, _, kind in METRIC_DEFS)
+
+# Query texts are built once from METRIC_DEFS. psycopg2 binds parameters client-side
+# and QuestDB has no SQL-level PREPARE/EXECUTE, so instead repeated polls for the same
+# device send byte-identical SQL that QuestDB's PG select cache (pg.select.cache.enabled)
+# can answer with the already compiled plan.
+_METRIC_COLUMNS = ", ".join(_METRIC_NAMES)
+
+LATEST_SQL = f"""
+    SELECT ts, {_METRIC_COLUMNS}
+    FROM olimex_data
+    WHERE device_id = %s
+    ORDER BY ts DESC
+    LIMIT 1;
+"""
+
+# Range results are read row by row over the normal PG protocol. COPY (...) TO STDOUT
+# would skip per-row type casting, but QuestDB's PG wire does not implement it.
+RANGE_SQL = f"""
+    SELECT ts, {_METRIC_COLUMNS}
+    FROM olimex_data
+    WHERE device_id = %s
+      AND ts BETWEEN %s AND %s
+    ORDER BY ts ASC
+    LIMIT %s;
+"""
+
 
 class DataQuery(BaseModel):
     device_id: str
@@ -79,29 +140,63 @@ class DataQuery(BaseModel):
 # DATABASE CONNECTION HELPER (Refactored for testability)
 # =======================
 
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """
+    Return the shared QuestDB connection pool, creating it on first use.
+    """
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                logger.debug("Creating QuestDB connection pool...")
+                _db_pool = psycopg2.pool.ThreadedConnectionPool(POOL_MIN_CONN, POOL_MAX_CONN, **DB_CONFIG)
+                logger.debug("QuestDB connection pool created.")
+    return _db_pool
+
+
+def close_db_pool():
+    """
+    Close all pooled QuestDB connections.
+    """
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.closeall()
+            _db_pool = None
+
+
 @contextmanager
-def get_db_cursor():
+def get_db_cursor(readonly: bool = True):
     """
-    Establishes a connection to QuestDB, yields the cursor, and handles
-    connection closing and error reporting. Used for reading/querying data.
+    Borrows a connection from the QuestDB pool, yields the cursor, and handles
+    returning the connection and error reporting. Used for reading/querying data.
+
+    Read-only use runs in autocommit mode, so no transaction is opened and no
+    COMMIT round-trip is sent; pass readonly=False for statements that write.
     """
+    pool = None
     conn = None
     cur = None
     try:
-        logger.debug("Attempting to connect to QuestDB for query...")
-        conn = psycopg2.connect(**DB_CONFIG)
-        logger.debug("QuestDB connection established.")
+        pool = get_db_pool()
+        conn = pool.getconn()
+        conn.autocommit = readonly
         cur = conn.cursor()
         yield cur
-        conn.commit()
+        if not readonly:
+            conn.commit()
     except psycopg2.OperationalError as e:
-        logger.error(f"Database connection failed: {str(e)}") # Log fejlen
+        logger.error("Database connection failed: %s", e) # Log fejlen
         raise HTTPException(
             status_code=500, 
             detail=f"Database connection failed: {str(e)}"
         )
     except Exception as e:
-        logger.error(f"Database operation failed: {str(e)}") # Log fejlen
+        logger.error("Database operation failed: %s", e) # Log fejlen
         if conn:
             conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database operation failed: {str(e)}")
@@ -109,67 +204,95 @@ def get_db_cursor():
         if cur:
             cur.close()
         if conn:
-            conn.close()
+            pool.putconn(conn)
 
 # =======================
 # HELPERS & ENDPOINTS
 # =======================
 
-def row_to_metrics(ts, row_values):
+def rows_to_metrics(rows):
     """
-    Convert a single DB row (values after ts) to a list of metric dicts.
+    Convert DB rows (ts followed by the metric values) to one flat list of metric dicts.
     """
     metrics = []
-    for (name, unit), value in zip(METRIC_DEFS, row_values):
-        if value is None:
+    append = metrics.append
+    # A single loop over all rows: no per-row function call or list.extend
+    for row in rows:
+        values = row[1:]
+        # Rows with no values at all (device downtime) produce no metrics; tuple.count
+        # checks that in C instead of running the per-metric loop
+        if values.count(None) == _METRIC_COUNT:
             continue
-        try:
-            numeric_value = float(value)
-        except Exception:
-            numeric_value = value
-
-        metrics.append({
-            "metric_name": name,
-            "metric_value": numeric_value,
-            "unit": unit,
-            "timestamp": ts.isoformat()
-        })
+        ts = row[0]
+        for template, is_int, value in zip(_METRIC_TEMPLATES, _METRIC_IS_INT, values):
+            if value is None:
+                continue
+            # Copying the prebuilt dict is cheaper than building a 4-key literal per metric
+            metric = template.copy()
+            # psycopg2 already returns DOUBLE as float and INT/LONG as int, so float()
+            # is only a fallback for unexpected types in DOUBLE columns.
+            metric["metric_value"] = value if is_int or type(value) is float else float(value)
+            metric["timestamp"] = ts # ISO 8601 string via orjson in the response
+            append(metric)
     return metrics
 
 
+def row_to_metrics(ts, row_values):
+    """
+    Convert a single DB row (values after ts) to a list of metric dicts.
+    """
+    return rows_to_metrics(((ts, *row_values),))
+
+
 @app.on_event("startup")
 async def startup_event():
     """ Log, når serveren starter, og lav en indledende DB-forbindelse. """
     logger.info("FastAPI server starting up...")
     
-    # 1. Opret 'logging' tabellen FØR vi prøver at bruge loggeren
-    try:
-        create_logging_table(DB_CONFIG)
-    except OperationalError:
-        # Hvis tabellen ikke kan oprettes, vil logs kun vises i konsollen (DBHandler vil reconnecte)
-        logger.warning("QuestDB logging table creation failed. Logs will only appear in console.")
-    
-    # 2. Tjek om QuestDB er tilgængelig for queries (via get_db_cursor)
+    # Opret connection pool'en her i stedet for ved import, og sikr begge tabeller
+    # i én transaktion på en pooled forbindelse (ingen separate forbindelser).
     try:
-        with get_db_cursor():
-            logger.info("Initial QuestDB connection for queries successful.")
+        with get_db_cursor(readonly=False) as cur:
+            cur.execute(LOGGING_TABLE_SCHEMA)
+            cur.execute(OLIMEX_TABLE_SCHEMA)
+        logger.info("QuestDB tables verified/created and connection pool initialized.")
     except HTTPException:
-        logger.warning("QuestDB is not immediately available for queries; endpoint retries expected.")
+        # Logs vises kun i konsollen indtil QuestDB er oppe (DBHandler vil reconnecte)
+        logger.warning("QuestDB is not immediately available; logs only in console and endpoint retries expected.")
     
     logger.info("API startup tasks complete.")
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """ Tøm log-køen, så de sidste logbeskeder når frem til QuestDB. """
+    logger.info("FastAPI server shutting down...")
+    close_db_pool()
+    stop_logging()
+
+
+_devices_cache = {"t": 0.0, "v": None}
+_devices_cache_lock = threading.Lock()
+
+
 @app.get("/api/devices")
 def get_devices():
     """
-    Return list of device_ids from olimex_data
+    Return list of device_ids from olimex_data (cached for DEVICES_CACHE_TTL seconds)
     """
     logger.info("Endpoint accessed: /api/devices")
-    with get_db_cursor() as cur:
-        cur.execute("SELECT DISTINCT device_id FROM olimex_data;")
-        devices = [row[0] for row in cur.fetchall()]
-        logger.info(f"Found {len(devices)} unique devices.")
-        return {"devices": devices}
+    with _devices_cache_lock:
+        if _devices_cache["v"] is not None and time.monotonic() - _devices_cache["t"] < DEVICES_CACHE_TTL:
+            return _devices_cache["v"]
+
+        with get_db_cursor() as cur:
+            cur.execute("SELECT DISTINCT device_id FROM olimex_data;")
+            devices = [row[0] for row in cur.fetchall()]
+            logger.info("Found %d unique devices.", len(devices))
+
+        _devices_cache["v"] = {"devices": devices}
+        _devices_cache["t"] = time.monotonic()
+        return _devices_cache["v"]
 
 
 @app.get("/api/data/latest/{device_id}")
@@ -177,30 +300,13 @@ def get_latest_data(device_id: str):
     """
     Return the latest row for a device, converted to a list of metrics.
     """
-    logger.info(f"Endpoint accessed: /api/data/latest/{device_id}")
+    logger.info("Endpoint accessed: /api/data/latest/%s", device_id)
     with get_db_cursor() as cur:
-        cur.execute(
-            """
-            SELECT
-                ts,
-                heat_exchanger_efficiency, run_mode,
-                outdoor_temp, supply_air_temp, supply_air_setpoint_temp,
-                exhaust_air_temp, extract_air_temp,
-                supply_air_pressure, extract_air_pressure,
-                supply_air_flow, extract_air_flow,
-                extra_supply_air_flow, extra_extract_air_flow,
-                supply_air_fan_runtime, extract_air_fan_runtime
-            FROM olimex_data
-            WHERE device_id = %s
-            ORDER BY ts DESC
-            LIMIT 1;
-            """,
-            (device_id,)
-        )
+        cur.execute(LATEST_SQL, (device_id,))
         row = cur.fetchone()
         
         if not row:
-            logger.warning(f"No data found for device: {device_id}")
+            logger.warning("No data found for device: %s", device_id)
             raise HTTPException(status_code=404, detail="No data found for device")
 
         ts = row[0]
@@ -208,11 +314,12 @@ def get_latest_data(device_id: str):
 
         metrics = row_to_metrics(ts, values)
 
-        return {
+        # Returned as a Response so FastAPI skips jsonable_encoder and orjson does all the work
+        return ORJSONResponse({
             "device_id": device_id,
-            "timestamp": ts.isoformat(),
+            "timestamp": ts,
             "data": metrics
-        }
+        })
 
 
 @app.post("/api/data/query")
@@ -220,38 +327,26 @@ def query_data(data: DataQuery):
     """
     Query historical data for a device and time range from olimex_data.
     """
-    logger.info(f"Endpoint accessed: /api/data/query for device {data.device_id}")
+    logger.info("Endpoint accessed: /api/data/query for device %s", data.device_id)
     with get_db_cursor() as cur:
-        cur.execute(
-            """
-            SELECT
-                ts,
-                heat_exchanger_efficiency, run_mode,
-                outdoor_temp, supply_air_temp, supply_air_setpoint_temp,
-                exhaust_air_temp, extract_air_temp,
-                supply_air_pressure, extract_air_pressure,
-                supply_air_flow, extract_air_flow,
-                extra_supply_air_flow, extra_extract_air_flow,
-                supply_air_fan_runtime, extract_air_fan_runtime
-            FROM olimex_data
-            WHERE device_id = %s
-              AND ts BETWEEN %s AND %s
-            ORDER BY ts ASC
-            LIMIT %s;
-            """,
-            (data.device_id, data.start_time, data.end_time, data.limit)
-        )
-
-        rows = cur.fetchall()
-        all_metrics = []
+        cur.execute(RANGE_SQL, (data.device_id, data.start_time, data.end_time, data.limit))
 
-        for row in rows:
-            ts = row[0]
-            values = row[1:]
-            all_metrics.extend(row_to_metrics(ts, values))
+        # Iterate the cursor instead of fetchall(): rows are converted to Python
+        # tuples one at a time, so the full row list and the metric list are never
+        # held in memory together. (QuestDB has no DECLARE CURSOR, so a named
+        # server-side cursor is not an option.)
+        all_metrics = rows_to_metrics(cur)
         
-        logger.info(f"Query returned {len(rows)} database rows.")
-        return {"data": all_metrics}
+        logger.info("Query returned %d database rows.", cur.rowcount)
+        return ORJSONResponse({"data": all_metrics})
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Return internal counters for monitoring the backend itself.
+    """
+    return {"log_records_dropped": get_dropped_log_count()}
 
 
 @app.get("/")
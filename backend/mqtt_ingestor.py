@@ -1,22 +1,36 @@
 import paho.mqtt.client as mqtt
 import psycopg2
-import json
-import datetime
+import psycopg2.pool
+from psycopg2.extras import execute_values
+import orjson
+import functools
+import threading
 import time
+from collections import deque
 import os
 import logging
 import sys
 
+try:
+    # Valgfri: QuestDB's ILP-klient. Uden den skrives rækkerne over PG wire.
+    from questdb.ingress import Sender, TimestampNanos
+except ImportError:
+    Sender = None
+    TimestampNanos = None
+
 # Korrekt import af de funktioner, der er defineret i din logging_config.py
 try:
     from .logging_config import configure_logging, create_logging_table
+    from .db_schema import OLIMEX_TABLE_SCHEMA
 except ImportError:
     # Fallback for direkte eksekvering (hvis ikke kørt som del af en pakke)
     from logging_config import configure_logging, create_logging_table
+    from db_schema import OLIMEX_TABLE_SCHEMA
 
 # --- QuestDB/PostgreSQL Konfiguration ---
 QDB_HOST = "localhost"
 QDB_PORT = "8812" # QuestDB PostgreSQL wire protocol port
+ILP_PORT = 9009    # QuestDB ILP/TCP port (bruges når questdb-klienten er installeret)
 
 # --- MQTT Konfiguration ---
 MQTT_HOST = "localhost"
@@ -25,10 +39,59 @@ MQTT_TOPIC = "sensors/#"
 MQTT_USER = "edgeuser"
 MQTT_PASS = "Optilogic25"
 CA_CERT_PATH = "/home/amir/iot-monitoring/mosquitto/config/certs/ca.crt"
+MQTT_MAX_INFLIGHT = 1000
+MQTT_MAX_QUEUED = 10_000
+
+# Connection pool til QuestDB (oprettes i __main__). Flush låner en forbindelse
+# pr. batch i stedet for at dele én global forbindelse og cursor.
+POOL_MIN_CONN = 2
+POOL_MAX_CONN = 8
+db_pool = None
+
+# --- Batch-indsættelse ---
+# Rækker samles og skrives med én execute_values + én commit pr. batch i stedet
+# for en round-trip pr. besked. COPY ... FROM STDIN (psycopg3) ville være endnu
+# hurtigere, men QuestDB's PG wire understøtter ikke COPY; til bulk-indlæsning
+# uden om PG wire er ILP-protokollen QuestDB's egen vej.
+FLUSH_SIZE = 500      # Antal rækker, der vækker flush-tråden
+FLUSH_INTERVAL = 1.0  # Sekunder mellem flushes ved lav beskedrate
+BUFFER_SIZE = 10_000  # Maks. ventende rækker; ved fuld buffer droppes de ældste
+
+# Målekolonnerne i olimex_data (se db_schema.py) i fast rækkefølge. Nøgler i
+# payloadet udenfor listen ignoreres, og manglende nøgler indsættes som NULL.
+_FIELDS = (
+    "heat_exchanger_efficiency", "run_mode", "outdoor_temp",
+    "supply_air_temp", "supply_air_setpoint_temp", "exhaust_air_temp", "extract_air_temp",
+    "supply_air_pressure", "extract_air_pressure",
+    "supply_air_flow", "extract_air_flow", "extra_supply_air_flow", "extra_extract_air_flow",
+    "supply_air_fan_runtime", "extract_air_fan_runtime",
+)
+# Over ILP sendes Python int som LONG og float som DOUBLE, så _parse tilpasser
+# værdierne kolonnetypen. Heltalskolonner har et gyldigt interval efter
+# kolonnebredden; QuestDB bruger minimumsværdien som NULL, så den er udeladt.
+_INT_RANGE = (-(2**31) + 1, 2**31 - 1)   # INT
+_LONG_RANGE = (-(2**63) + 1, 2**63 - 1)  # LONG
+_INT_FIELDS = {
+    "run_mode": _INT_RANGE,
+    "supply_air_fan_runtime": _LONG_RANGE,
+    "extract_air_fan_runtime": _LONG_RANGE,
+}
+# Interval pr. kolonne i _FIELDS-rækkefølge; None for DOUBLE-kolonner
+_FIELD_INT_RANGE = tuple(_INT_FIELDS.get(name) for name in _FIELDS)
+_INSERT_SQL = f"INSERT INTO olimex_data (ts, device_id, {', '.join(_FIELDS)}) VALUES %s"
+# ts bindes som epoch-mikrosekunder og castes server-side, så der ikke bygges et
+# datetime-objekt pr. besked
+_INSERT_TEMPLATE = f"(%s::TIMESTAMP, %s, {', '.join(['%s'] * len(_FIELDS))})"
 
-# Global database connection and cursor (styret i __main__)
-conn = None
-cur = None
+# MQTT-tråden lægger kun rækker i bufferen; DB-skrivningen sker i en separat
+# flush-tråd, så netværksløkken aldrig venter på QuestDB.
+_buffer = deque(maxlen=BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+_flush_requested = threading.Event()
+_stopped = threading.Event()
+_flush_thread = None
+dropped_rows = 0  # Tabte rækker: fuld buffer, afvist af QuestDB eller uskrevet ved nedlukning
+_sender = None  # ILP-forbindelse, oprettes ved første flush
 
 # Global logger for dette script
 # Dette er den logger, vi vil bruge til at generere logbeskeder (navnet 'mqtt_ingestor' gemmes i loggen)
@@ -36,19 +99,21 @@ logger = logging.getLogger('mqtt_ingestor')
 
 # --- QuestDB Database Handlers ---
 
-def create_db_connection(max_retries=10):
-    """Etablerer forbindelse til QuestDB ved hjælp af psycopg2."""
+def create_db_pool(max_retries=10):
+    """Opretter en psycopg2 connection pool til QuestDB med genforsøg ved opstart."""
     for attempt in range(max_retries):
         try:
-            db_conn = psycopg2.connect(
+            new_pool = psycopg2.pool.ThreadedConnectionPool(
+                POOL_MIN_CONN,
+                POOL_MAX_CONN,
                 database="qdb",
                 user="admin",
                 password="quest",
                 host=QDB_HOST,
                 port=QDB_PORT
             )
-            logger.info("QuestDB dataforbindelse etableret succesfuldt.")
-            return db_conn
+            logger.info("QuestDB connection pool etableret succesfuldt.")
+            return new_pool
         except psycopg2.OperationalError as e:
             logger.warning(f"QuestDB dataforbindelse forsøg {attempt+1}/{max_retries} mislykkedes: {e}")
             if attempt < max_retries - 1:
@@ -57,32 +122,18 @@ def create_db_connection(max_retries=10):
                 logger.critical("QuestDB dataforbindelse mislykkedes efter maksimum forsøg.", exc_info=True)
                 raise
 
-def create_table(cursor):
+def create_table(pool):
     """Sikrer, at datatabellen 'olimex_data' eksisterer."""
-    table_create_sql = """
-    CREATE TABLE IF NOT EXISTS olimex_data (
-        ts TIMESTAMP,
-        device_id SYMBOL,
-        heat_exchanger_efficiency DOUBLE,
-        run_mode INT,
-        outdoor_temp DOUBLE,
-        supply_air_temp DOUBLE,
-        supply_air_setpoint_temp DOUBLE,
-        exhaust_air_temp DOUBLE,
-        extract_air_temp DOUBLE,
-        supply_air_pressure DOUBLE,
-        extract_air_pressure DOUBLE,
-        supply_air_flow DOUBLE,
-        extract_air_flow DOUBLE,
-        extra_supply_air_flow DOUBLE,
-        extra_extract_air_flow DOUBLE,
-        supply_air_fan_runtime LONG,
-        extract_air_fan_runtime LONG
-    ) TIMESTAMP(ts)
-    PARTITION BY DAY;
-    """
-    cursor.execute(table_create_sql)
-    conn.commit()
+    table_conn = pool.getconn()
+    try:
+        # Enkelt DDL-sætning: autocommit sparer BEGIN/COMMIT. Flush-stien bruger
+        # derimod eksplicitte transaktioner med én commit pr. batch.
+        table_conn.autocommit = True
+        with table_conn.cursor() as table_cur:
+            table_cur.execute(OLIMEX_TABLE_SCHEMA)
+    finally:
+        table_conn.autocommit = False
+        pool.putconn(table_conn)
     logger.info("QuestDB datatabel 'olimex_data' kontrolleret/oprettet.")
 
 # --- MQTT Callbacks ---
@@ -95,62 +146,226 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
     else:
         logger.error(f"MQTT Forbindelse mislykkedes med kode {reason_code}")
 
-def on_message(client, userdata, msg):
-    """Callback for når en PUBLISH-besked modtages fra brokeren."""
-    global conn, cur
+@functools.lru_cache(maxsize=1024)
+def _device_from_topic(topic):
+    """Udpakker device_id fra emnet (f.eks. sensors/device_X); få enheder giver ~100% cache-hits."""
+    return topic.rsplit('/', 1)[-1]
 
+def _coerce(name, value, int_range):
+    """Tilpasser en payload-værdi til kolonnetypen; ugyldige værdier gemmes som NULL."""
+    if value is None:
+        return None
     try:
-        # Udpak device_id fra emnet (f.eks. sensors/device_X)
-        device_id = msg.topic.split('/')[-1]
-        payload = msg.payload.decode()
-        data = json.loads(payload)
-        
-    except Exception as e:
-        logger.error(f"Fejl ved parsing af besked fra emne {msg.topic}: {e}", exc_info=True)
+        if int_range is None:
+            return float(value)
+        if type(value) is float:
+            # 2.0 er et heltal, men 2.7 (eller NaN/inf) ville blive afkortet af int()
+            if not value.is_integer():
+                raise ValueError("not an integer")
+        number = int(value)
+        # Uden for kolonnebredden ville QuestDB afvise hele batch-INSERT'en
+        if not int_range[0] <= number <= int_range[1]:
+            raise ValueError("out of range")
+        return number
+    except (TypeError, ValueError, OverflowError):
+        # F.eks. "n/a" eller et indlejret objekt: kun denne værdi går tabt, ikke hele batchen
+        logger.warning("Ugyldig værdi for %s: %r. Gemmes som NULL.", name, value)
+        return None
+
+def _parse(msg):
+    """Bygger rækken (ts, device_id, *_FIELDS) fra en besked, eller None ved ugyldigt payload."""
+    # Kun selve parsingen er i try-blokken; resten kører uden exception-håndtering
+    try:
+        # orjson parser direkte fra bytes, uden .decode()
+        data = orjson.loads(msg.payload)
+    except orjson.JSONDecodeError as e:
+        logger.error("Fejl ved parsing af besked fra emne %s: %s", msg.topic, e)
+        return None
+    if type(data) is not dict:
+        logger.error("Payload fra emne %s er ikke et JSON-objekt.", msg.topic)
+        return None
+
+    device_id = _device_from_topic(msg.topic)
+
+    # Aktuel UTC tid for QuestDB som epoch-mikrosekunder
+    ts = time.time_ns() // 1000
+
+    # Én comprehension over de faste felter; værdierne har kolonnens type, så en
+    # enkelt dårlig værdi ikke kan få batch-INSERT'en til at fejle
+    return (ts, device_id, *[_coerce(k, data.get(k), rng) for k, rng in zip(_FIELDS, _FIELD_INT_RANGE)])
+
+def _store(params):
+    """Lægger rækken i bufferen og vækker flush-tråden ved FLUSH_SIZE."""
+    global dropped_rows
+    with _buffer_lock:
+        if len(_buffer) == _buffer.maxlen:
+            dropped_rows += 1
+        _buffer.append(params)
+        pending = len(_buffer)
+
+    if pending >= FLUSH_SIZE:
+        _flush_requested.set()
+
+def on_message(client, userdata, msg):
+    """Callback for når en PUBLISH-besked modtages fra brokeren."""
+    params = _parse(msg)
+    if params is None:
         return
 
-    # Rydder data-nøgler, hvis de findes i payloadet
-    if "device_id" in data:
-        del data["device_id"]
-    if "timestamp" in data:
-        del data["timestamp"]
+    # Pr. besked kun på DEBUG med lazy argumenter, så INFO-drift ikke formaterer noget
+    logger.debug("Modtaget fra emne %s for enhed %s. Tilføjer til batch.", msg.topic, params[1])
+
+    _store(params)
 
-    # Bruger aktuel UTC tid for QuestDB
-    ts = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+def flush_buffer():
+    """
+    Skriver alle bufferede rækker til QuestDB med én commit pr. batch.
+    Returnerer False, hvis QuestDB ikke kunne nås; rækkerne bliver så i bufferen.
+    """
+    with _buffer_lock:
+        if not _buffer:
+            return True
+        rows = list(_buffer)
+        _buffer.clear()
 
-    columns = ["ts", "device_id"] + list(data.keys())
-    placeholders = ["%s"] * len(columns)
+    if Sender is not None:
+        unsent = _write_ilp(rows)
+    else:
+        unsent = _write_pg(rows)
 
-    sql = f"INSERT INTO olimex_data ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
-    params = [ts, device_id] + list(data.values())
+    if unsent:
+        _requeue(unsent)
+        return False
+    return True
 
-    logger.info(f"Modtaget fra emne {msg.topic} for enhed {device_id}. Indsætter i DB.")
+def _requeue(rows):
+    """Lægger ikke-skrevne rækker tilbage foran nyere rækker, inden for BUFFER_SIZE."""
+    global dropped_rows
+    with _buffer_lock:
+        newer = list(_buffer)
+        _buffer.clear()
+        # extend() på den begrænsede deque smider fra venstre, dvs. de ældste rækker
+        _buffer.extend(rows)
+        _buffer.extend(newer)
+        dropped_rows += len(rows) + len(newer) - len(_buffer)
+
+def _count_dropped(count):
+    global dropped_rows
+    with _buffer_lock:
+        dropped_rows += count
+
+def _write_ilp(rows):
+    """
+    Sender rækkerne over ILP: ren append uden SQL-parsing eller commit.
+    Returnerer de rækker, der skal forsøges igen, hvis QuestDB ikke kunne nås.
+    """
+    global _sender
+    accepted = []
+    pending = rows  # Rækker, der gemmes til næste forsøg, hvis afsendelsen fejler
+    try:
+        if _sender is None:
+            _sender = Sender.from_conf(f"tcp::addr={QDB_HOST}:{ILP_PORT};")
+            _sender.establish()
+        for row in rows:
+            ts, device_id, *values = row
+            # Værdierne har allerede kolonnens type fra _parse; NULL udelades
+            columns = {name: value for name, value in zip(_FIELDS, values) if value is not None}
+            try:
+                _sender.row("olimex_data", symbols={"device_id": device_id}, columns=columns, at=TimestampNanos(ts * 1000))
+            except Exception as e:
+                # En afvist række springes over; resten af batchen sendes stadig
+                logger.error("Fejl ved ILP-række for enhed %s: %s. Rækken droppes.", device_id, e)
+                _count_dropped(1)
+                continue
+            accepted.append(row)
+        pending = accepted
+        _sender.flush()
+        logger.debug("Sendt %d rækker over ILP (%d droppet).", len(accepted), len(rows) - len(accepted))
+    except Exception as e:
+        logger.error(f"Fejl ved ILP-afsendelse: {e}. Beholder {len(pending)} rækker til næste forsøg.", exc_info=True)
+        _close_sender() # Genforbind ved næste batch
+        return pending
+    return []
+
+def _close_sender():
+    global _sender
+    if _sender is not None:
+        try:
+            _sender.close(flush=False)
+        except Exception:
+            pass
+        _sender = None
+
+def _write_pg(rows):
+    """
+    Indsætter rækkerne over PG wire med execute_values og én commit.
+    Returnerer de rækker, der skal forsøges igen, hvis QuestDB ikke kunne nås.
+    """
+    row_count = len(rows)
 
     max_retries = 2
     for attempt in range(max_retries):
+        conn = None
+        broken = False
         try:
-            cur.execute(sql, tuple(params))
+            conn = db_pool.getconn()
+            with conn.cursor() as cur:
+                execute_values(cur, _INSERT_SQL, rows, template=_INSERT_TEMPLATE, page_size=FLUSH_SIZE)
             conn.commit()
-            logger.debug(f"Indsat række for enhed: {device_id}")
-            break
+            logger.debug("Indsat %d rækker i én batch.", row_count)
+            return []
         except psycopg2.OperationalError as e:
+            # Forbindelsen er død: den lukkes ved tilbagelevering, og næste forsøg
+            # låner en ny fra poolen
+            broken = True
             logger.warning(f"Database driftsfejl på forsøg {attempt+1}. Genforbindelse nødvendig: {e}")
             if attempt < max_retries - 1:
-                logger.info("Forsøger at genoprette forbindelse til QuestDB...")
-                try:
-                    conn.close()
-                    conn = create_db_connection()
-                    cur = conn.cursor()
-                    # Prøv forespørgslen igen straks i næste løkke
-                except Exception as reconnect_e:
-                    logger.critical(f"Genforbindelse mislykkedes: {reconnect_e}")
-                    time.sleep(1)
+                logger.info("Forsøger igen med en ny forbindelse fra poolen...")
             else:
-                logger.error("Kunne ikke genoprette forbindelse efter max forsøg. Dropper besked.", exc_info=True)
-                break
+                logger.error(f"Kunne ikke genoprette forbindelse efter max forsøg. Beholder {row_count} rækker til næste flush.")
         except Exception as e:
-            logger.critical(f"Fatale fejl under indsættelse: {e}. Dropper besked.", exc_info=True)
-            break
+            # QuestDB afviste selve batchen; et nyt forsøg ville fejle på samme måde
+            logger.critical(f"Fatale fejl under indsættelse: {e}. Dropper {row_count} rækker.", exc_info=True)
+            _count_dropped(row_count)
+            if conn:
+                conn.rollback()
+            return []
+        finally:
+            if conn:
+                db_pool.putconn(conn, close=broken)
+    return rows
+
+def _flush_loop():
+    """Flusher bufferen hvert FLUSH_INTERVAL sekund, eller når FLUSH_SIZE er nået."""
+    while not _stopped.is_set():
+        _flush_requested.wait(FLUSH_INTERVAL)
+        _flush_requested.clear()
+        if not flush_buffer():
+            # QuestDB kan ikke nås: vent et helt interval før næste forsøg, også selvom
+            # on_message bliver ved med at vække tråden
+            _stopped.wait(FLUSH_INTERVAL)
+
+def start_flusher():
+    """Starter baggrundstråden, der skriver bufferen til QuestDB."""
+    global _flush_thread
+    _stopped.clear()
+    _flush_thread = threading.Thread(target=_flush_loop, name="mqtt_ingestor-flush", daemon=True)
+    _flush_thread.start()
+
+def stop_flusher():
+    """Stopper flush-tråden og skriver de sidste bufferede rækker."""
+    global dropped_rows
+    _stopped.set()
+    _flush_requested.set()
+    if _flush_thread is not None:
+        _flush_thread.join()
+    if not flush_buffer():
+        with _buffer_lock:
+            unsent = len(_buffer)
+            dropped_rows += unsent
+            _buffer.clear()
+        logger.error("%d rækker kunne ikke skrives til QuestDB før nedlukning.", unsent)
+    _close_sender()
 
 if __name__ == '__main__':
     # 1. QuestDB Log Initialisering
@@ -182,9 +397,8 @@ if __name__ == '__main__':
 
     # 2. QuestDB Dataforbindelsesopsætning
     try:
-        conn = create_db_connection()
-        cur = conn.cursor()
-        create_table(cur)
+        db_pool = create_db_pool()
+        create_table(db_pool)
     except Exception as e:
         logger.critical(f"Kritisk QuestDB initialiseringsfejl: {e}")
         sys.exit(1)
@@ -192,6 +406,11 @@ if __name__ == '__main__':
     # 3. MQTT Klientopsætning
     client = mqtt.Client(client_id="QuestDB_Ingestor", protocol=mqtt.MQTTv5)
     client.username_pw_set(MQTT_USER, MQTT_PASS)
+    # Højere grænser end paho's standard (20 inflight) og korte reconnect-pauser,
+    # så klienten ikke begrænser gennemløbet ved bursts
+    client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+    client.max_queued_messages_set(MQTT_MAX_QUEUED)
+    client.reconnect_delay_set(min_delay=1, max_delay=10)
     
     # Tjek om CA-certifikatfilen eksisterer
     if os.path.exists(CA_CERT_PATH):
@@ -206,6 +425,8 @@ if __name__ == '__main__':
     client.on_connect = on_connect
     client.on_message = on_message
 
+    start_flusher()
+
     # 4. Kørslen
     try:
         client.connect(MQTT_HOST, MQTT_PORT, 60)
@@ -215,6 +436,8 @@ if __name__ == '__main__':
     except Exception as e:
         logger.critical(f"En uventet MQTT-fejl opstod: {e}", exc_info=True)
     finally:
-        if conn:
-            conn.close()
-            logger.info("QuestDB dataforbindelse lukket.")
+        if db_pool:
+            # Skriv de sidste bufferede rækker, før forbindelserne lukkes
+            stop_flusher()
+            db_pool.closeall()
+            logger.info("QuestDB dataforbindelser lukket.")
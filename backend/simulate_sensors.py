@@ -5,6 +5,13 @@ import random
 import os
 import sys
 
+# orjson giver UTF-8 bytes direkte; ellers stdlib json (paho encoder selv str'en)
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    _dumps = json.dumps
+
 # --- MQTT Konfiguration (SKAL MATCHES MED MOSQUITTO & INGESTOR) ---
 MQTT_HOST = "localhost"
 MQTT_PORT = 8883  # Sikker port, der kræver TLS
@@ -15,6 +22,12 @@ CA_CERT_PATH = "/home/amir/iot-monitoring/mosquitto/config/certs/ca.crt"
 DEVICES = ["device_1", "device_2", "device_3"]
 # Simulation bruger de enkelte device topics: sensors/device_X
 
+# (device_id, topic) bygget én gang i stedet for en f-string pr. publish
+_DEVICE_TOPICS = tuple((device_id, f"sensors/{device_id}") for device_id in DEVICES)
+
+# Værdierne trækkes med random.uniform/round pr. felt. Med få enheder hvert 5.
+# sekund er det ikke en flaskehals, og numpy er ikke en afhængighed i projektet,
+# så en vektoriseret trækning pr. tick giver ingen mening her.
 def generate_sensor_data(device_id):
     """Genererer realistiske tilfældige sensordata for en enhed."""
     
@@ -84,12 +97,11 @@ def run_simulation():
 
     try:
         while True:
-            for device_id in DEVICES:
-                topic = f"sensors/{device_id}" 
+            for device_id, topic in _DEVICE_TOPICS:
                 payload = generate_sensor_data(device_id)
                 
                 # Udgiv til broker med QoS 1
-                result = client.publish(topic, json.dumps(payload), qos=1)
+                result = client.publish(topic, _dumps(payload), qos=1)
                 
                 if result.rc == mqtt.MQTT_ERR_SUCCESS:
                     print(f"[{time.strftime('%H:%M:%S')}] ✅ PUBLISH OK | Enhed: {device_id} | Temp: {payload['outdoor_temp']} °C")
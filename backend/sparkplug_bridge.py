@@ -6,20 +6,21 @@ SparkplugB-style topics:
 
   spBv1.0/<GROUP_ID>/NDATA/<EDGE_ID>/<device_id>
 
-Instead of real binary SparkplugB protobuf payloads, we send a simple JSON:
+Instead of real binary SparkplugB protobuf payloads, we send a simple, flat JSON
+with the metrics plus a timestamp (the device_id is already the last topic level):
 
 {
-  "device_id": "...",
-  "timestamp": 1234567890,
-  "metrics": {
-      "SupplyTemp": ...,
-      "ExtractTemp": ...,
-      "SupplyFlow": ...,
-      "Efficiency": ...,
-      "RunMode": ...
-  }
+  "SupplyTemp": ...,
+  "ExtractTemp": ...,
+  "SupplyFlow": ...,
+  "Efficiency": ...,
+  "RunMode": ...,
+  "timestamp": 1234567890
 }
 
+Metrics and the timestamp share one flat object, so "timestamp" is a reserved
+key: no metric in _MAPPING may use it as its Sparkplug name.
+
 This is enough to:
 - Demonstrate Sparkplug topic structure
 - Separate JSON telemetry from "Sparkplug-style" telemetry
@@ -27,10 +28,24 @@ This is enough to:
 """
 
 import json
+import logging
+import queue
+import threading
 import time
 
 import paho.mqtt.client as mqtt
 
+# orjson parses and emits UTF-8 bytes in C; fall back to the stdlib if it is missing
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
 # ======== USER CONFIGURATION =====================================
 
 # >>> SET ME: Sparkplug group and edge identifiers (for exam/diagram)
@@ -46,10 +61,33 @@ MQTT_PASS = "Optilogic25"
 # We listen on the existing JSON topics from ESP32
 SOURCE_TOPIC = "sensors/#"
 
+# Max bridged messages waiting to be published; when full, new ones are dropped
+OUTBOUND_QUEUE_SIZE = 10_000
+# Max messages the publisher thread takes from the queue per wakeup
+PUBLISH_BATCH = 100
+
 # ================================================================
 
+logger = logging.getLogger(__name__)
+
+# GROUP_ID/EDGE_ID are fixed, so only the device_id is appended per message
+_TOPIC_PREFIX = f"spBv1.0/{GROUP_ID}/NDATA/{EDGE_ID}/"
+
+# (source key, Sparkplug metric name, type) for the values that are bridged
+_MAPPING = (
+    ("supply_temp", "SupplyTemp", float),
+    ("extract_temp", "ExtractTemp", float),
+    ("supply_flow", "SupplyFlow", float),
+    ("efficiency", "Efficiency", float),
+    ("run_mode", "RunMode", int),
+)
 
-def build_sparkplug_style_payload(device_id: str, data: dict) -> str:
+# (topic, payload) pairs waiting for the publisher thread
+_outq = queue.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+_dropped = 0
+
+
+def build_sparkplug_style_payload(data: dict) -> bytes:
     """
     Build a simple JSON payload that *looks* like Sparkplug metrics.
 
@@ -60,58 +98,110 @@ def build_sparkplug_style_payload(device_id: str, data: dict) -> str:
     """
     metrics = {}
 
-    if "supply_temp" in data:
-        metrics["SupplyTemp"] = float(data["supply_temp"])
-    if "extract_temp" in data:
-        metrics["ExtractTemp"] = float(data["extract_temp"])
-    if "supply_flow" in data:
-        metrics["SupplyFlow"] = float(data["supply_flow"])
-    if "efficiency" in data:
-        metrics["Efficiency"] = float(data["efficiency"])
-    if "run_mode" in data:
+    for src, dst, typ in _MAPPING:
+        value = data.get(src)
+        if value is None:
+            continue
+        # Values already parsed to the right type are used as-is; anything that
+        # cannot be converted (e.g. a textual run mode) is passed through unchanged
         try:
-            metrics["RunMode"] = int(data["run_mode"])
-        except ValueError:
-            metrics["RunMode"] = data["run_mode"]
+            metrics[dst] = value if type(value) is typ else typ(value)
+        except (TypeError, ValueError):
+            metrics[dst] = value
 
-    payload = {
-        "device_id": device_id,
-        "timestamp": int(time.time()),
-        "metrics": metrics,
-    }
-    return json.dumps(payload)
+    # Keep the payload small: device_id is in the topic, so only the metrics and
+    # one timestamp key are sent
+    metrics["timestamp"] = int(time.time())
+    return _dumps(metrics)
 
 
 def on_connect(client, userdata, flags, rc, properties=None):
-    print("Sparkplug JSON bridge connected to MQTT with result code", rc)
+    logger.info("Sparkplug JSON bridge connected to MQTT with result code %s", rc)
     client.subscribe(SOURCE_TOPIC)
-    print(f"Subscribed to {SOURCE_TOPIC}")
+    logger.info("Subscribed to %s", SOURCE_TOPIC)
 
 
-def on_message(client, userdata, msg):
+def _parse(msg):
+    """
+    Parse the JSON payload of a source message, or return None if it is invalid.
+    """
+    # Only the parse itself is guarded; the rest of the handler runs without a try block
+    try:
+        # Parse the raw bytes directly, no intermediate str
+        data = _loads(msg.payload)
+    except ValueError as e:
+        logger.error("Invalid JSON on %s in sparkplug JSON bridge: %s", msg.topic, e)
+        return None
+    if type(data) is not dict:
+        logger.error("Payload on %s is not a JSON object", msg.topic)
+        return None
+    return data
+
+
+def _enqueue(topic: str, sp_payload: bytes) -> bool:
+    """
+    Hand a bridged message to the publisher thread; drop it if the queue is full.
+    """
+    global _dropped
     try:
-        payload_str = msg.payload.decode("utf-8", errors="ignore")
-        data = json.loads(payload_str)
+        _outq.put_nowait((topic, sp_payload))
+    except queue.Full:
+        _dropped += 1
+        if _dropped % 1000 == 1:
+            logger.warning("Outbound queue full, %d bridged messages dropped so far", _dropped)
+        return False
+    return True
+
+
+def on_message(client, userdata, msg):
+    data = _parse(msg)
+    if data is None:
+        return
+
+    device_id = data.get("device_id", "UNKNOWN")
+    if type(device_id) is not str:
+        device_id = str(device_id)
+    sp_payload = build_sparkplug_style_payload(data)
 
-        device_id = data.get("device_id", "UNKNOWN")
-        sp_payload_str = build_sparkplug_style_payload(device_id, data)
+    topic = _TOPIC_PREFIX + device_id
+    # Hand off to the publisher thread so the network loop keeps reading
+    if not _enqueue(topic, sp_payload):
+        return
 
-        topic = f"spBv1.0/{GROUP_ID}/NDATA/{EDGE_ID}/{device_id}"
-        client.publish(topic, sp_payload_str, qos=0, retain=False)
+    # Per-message output only at DEBUG; the check skips the decode when disabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Bridged JSON -> Sparkplug-style JSON on topic: %s payload: %s", topic, sp_payload.decode())
 
-        print(f"Bridged JSON -> Sparkplug-style JSON on topic: {topic}")
-        print(f"  payload: {sp_payload_str}")
 
-    except Exception as e:
-        print("Error in sparkplug JSON bridge:", e)
+def publisher_loop(client):
+    """
+    Publish queued Sparkplug-style messages, off the MQTT receive thread.
+    """
+    get_nowait = _outq.get_nowait
+    while True:
+        # Block for the first message, then take whatever else is already waiting
+        # (up to PUBLISH_BATCH) so one wakeup publishes a whole burst
+        batch = [_outq.get()]
+        try:
+            while len(batch) < PUBLISH_BATCH:
+                batch.append(get_nowait())
+        except queue.Empty:
+            pass
+
+        for topic, payload in batch:
+            client.publish(topic, payload, qos=0, retain=False)
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
     client = mqtt.Client(client_id="sparkplug_json_bridge", protocol=mqtt.MQTTv311)
     client.username_pw_set(MQTT_USER, MQTT_PASS)
     client.on_connect = on_connect
     client.on_message = on_message
 
+    threading.Thread(target=publisher_loop, args=(client,), name="sparkplug-publisher", daemon=True).start()
+
     client.connect(MQTT_HOST, MQTT_PORT, 60)
     client.loop_forever()
 
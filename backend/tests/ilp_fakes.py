@@ -0,0 +1,6 @@
+class FakeTimestampNanos:
+    """Stand-in for questdb.ingress.TimestampNanos, which only accepts an int"""
+    def __init__(self, value):
+        if type(value) is not int:
+            raise TypeError("TimestampNanos requires an int")
+        self.value = value
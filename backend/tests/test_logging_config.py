@@ -0,0 +1,206 @@
+import unittest
+import logging
+import queue
+import threading
+from collections import deque
+from unittest.mock import patch
+
+from backend.logging_config import QuestDBHandler, DropOldestQueueHandler, OperationalError
+from backend.tests.ilp_fakes import FakeTimestampNanos
+
+MOCK_DB_CONFIG = {"dbname": "qdb", "user": "admin", "password": "quest", "host": "localhost", "port": 8812}
+
+
+def make_record(message, level=logging.INFO):
+    return logging.LogRecord("test_logger", level, __file__, 1, message, None, None)
+
+
+class TestQuestDBHandler(unittest.TestCase):
+
+    def setUp(self):
+        # Keep the background flusher idle so the tests control when batches are written
+        interval = patch.object(QuestDBHandler, 'FLUSH_INTERVAL', 60)
+        interval.start()
+        self.addCleanup(interval.stop)
+
+        psycopg2_patch = patch('backend.logging_config.psycopg2')
+        self.mock_psycopg2 = psycopg2_patch.start()
+        self.addCleanup(psycopg2_patch.stop)
+        self.mock_conn = self.mock_psycopg2.connect.return_value
+        self.mock_conn.closed = 0
+        self.mock_cur = self.mock_conn.cursor.return_value
+
+        # Exercise the PG wire path even when the optional questdb client is installed
+        sender_patch = patch('backend.logging_config.Sender', None)
+        sender_patch.start()
+        self.addCleanup(sender_patch.stop)
+
+        batch_patch = patch('backend.logging_config.execute_values')
+        self.mock_execute_values = batch_patch.start()
+        self.addCleanup(batch_patch.stop)
+
+    def test_emit_buffers_until_flush(self):
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        for i in range(3):
+            handler.emit(make_record(f"message {i}"))
+
+        self.mock_execute_values.assert_not_called()
+        handler.flush()
+
+        self.mock_execute_values.assert_called_once()
+        rows = self.mock_execute_values.call_args[0][2]
+        self.assertEqual([row[3] for row in rows], ["message 0", "message 1", "message 2"])
+        self.mock_conn.commit.assert_called_once()
+        handler.close()
+
+    def test_emit_timestamp_is_integer_microseconds(self):
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        record = make_record("timed")
+        record.created = 1_700_000_000.123456
+        record.msecs = 123.456
+        handler.emit(record)
+        handler.flush()
+
+        ts = self.mock_execute_values.call_args[0][2][0][0]
+        self.assertIs(type(ts), int)
+        self.assertEqual(ts, int(1_700_000_000.123456 * 1_000_000))
+        handler.close()
+
+    def test_threshold_wakes_flusher(self):
+        written = threading.Event()
+        self.mock_conn.commit.side_effect = written.set
+
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        with patch.object(QuestDBHandler, 'FLUSH_THRESHOLD', 2):
+            handler.emit(make_record("first"))
+            self.assertFalse(written.wait(0.1))
+            handler.emit(make_record("second"))
+            # The batch is written by the flusher thread, not by emit() itself
+            self.assertTrue(written.wait(2))
+
+        self.mock_execute_values.assert_called_once()
+        self.mock_conn.commit.assert_called_once()
+        handler.close()
+
+    def test_full_buffer_drops_oldest(self):
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        with patch.object(handler, '_buffer', deque(maxlen=2)):
+            for i in range(3):
+                handler.emit(make_record(f"message {i}"))
+            handler.flush()
+
+        rows = self.mock_execute_values.call_args[0][2]
+        self.assertEqual([row[3] for row in rows], ["message 1", "message 2"])
+        self.assertEqual(handler.dropped, 1)
+        handler.close()
+
+    def test_failed_connect_keeps_records(self):
+        self.mock_psycopg2.connect.side_effect = OperationalError("QuestDB is down")
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        for i in range(5):
+            handler.emit(make_record(f"message {i}"))
+
+        self.assertFalse(handler.flush())
+        self.assertEqual(len(handler._buffer), 5)
+        self.assertEqual(handler.dropped, 0)
+
+        # Once QuestDB is back, the kept records are written by the next flush
+        self.mock_psycopg2.connect.side_effect = None
+        self.assertTrue(handler.flush())
+        rows = self.mock_execute_values.call_args[0][2]
+        self.assertEqual([row[3] for row in rows], [f"message {i}" for i in range(5)])
+        handler.close()
+
+    def test_outage_drops_oldest_beyond_buffer_size(self):
+        self.mock_psycopg2.connect.side_effect = OperationalError("QuestDB is down")
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        with patch.object(handler, '_buffer', deque(maxlen=3)):
+            handler.emit(make_record("message 0"))
+            handler.emit(make_record("message 1"))
+            handler.flush()
+            handler.emit(make_record("message 2"))
+            handler.emit(make_record("message 3"))
+
+            self.assertEqual([row[3] for row in handler._buffer], ["message 1", "message 2", "message 3"])
+            self.assertEqual(handler.dropped, 1)
+            handler.close()
+
+    def test_close_counts_unsent_records(self):
+        self.mock_psycopg2.connect.side_effect = OperationalError("QuestDB is down")
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        handler.emit(make_record("message 0"))
+        handler.emit(make_record("message 1"))
+        handler.close()
+
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(len(handler._buffer), 0)
+
+    def test_rejected_batch_is_counted_as_dropped(self):
+        self.mock_execute_values.side_effect = ValueError("bad data")
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        handler.emit(make_record("message 0"))
+
+        self.assertTrue(handler.flush())
+        self.assertEqual(handler.dropped, 1)
+        self.mock_conn.rollback.assert_called_once()
+        self.mock_execute_values.side_effect = None
+        handler.close()
+
+    @patch('backend.logging_config.TimestampNanos', FakeTimestampNanos)
+    @patch('backend.logging_config.Sender')
+    def test_flush_uses_ilp_when_available(self, mock_sender_cls):
+        mock_sender = mock_sender_cls.from_conf.return_value
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        record = make_record("over ilp", level=logging.WARNING)
+        handler.emit(record)
+        handler.flush()
+
+        mock_sender_cls.from_conf.assert_called_once_with("tcp::addr=localhost:9009;")
+        mock_sender.row.assert_called_once()
+        args, kwargs = mock_sender.row.call_args
+        self.assertEqual(args[0], 'logging')
+        self.assertEqual(kwargs['columns'], {'level': 'WARNING', 'logger': 'test_logger', 'message': 'over ilp'})
+        self.assertIsInstance(kwargs['at'], FakeTimestampNanos)
+        self.assertEqual(kwargs['at'].value, int(record.created * 1_000_000) * 1000)
+        mock_sender.flush.assert_called_once()
+        self.mock_execute_values.assert_not_called()
+        handler.close()
+
+    @patch('backend.logging_config.TimestampNanos', FakeTimestampNanos)
+    @patch('backend.logging_config.Sender')
+    def test_failed_ilp_send_keeps_records(self, mock_sender_cls):
+        mock_sender = mock_sender_cls.from_conf.return_value
+        mock_sender.flush.side_effect = [OSError("connection reset"), None]
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        handler.emit(make_record("over ilp"))
+
+        self.assertFalse(handler.flush())
+        self.assertEqual(len(handler._buffer), 1)
+        self.assertTrue(handler.flush())
+        self.assertEqual(len(handler._buffer), 0)
+        self.assertEqual(handler.dropped, 0)
+        handler.close()
+
+    def test_close_flushes_pending_records(self):
+        handler = QuestDBHandler(MOCK_DB_CONFIG)
+        handler.emit(make_record("pending"))
+        handler.close()
+
+        self.mock_execute_values.assert_called_once()
+        self.mock_conn.close.assert_called_once()
+
+
+class TestDropOldestQueueHandler(unittest.TestCase):
+
+    def test_full_queue_drops_oldest(self):
+        log_queue = queue.Queue(maxsize=2)
+        handler = DropOldestQueueHandler(log_queue)
+        for i in range(3):
+            handler.emit(make_record(f"message {i}"))
+
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual([log_queue.get_nowait().getMessage() for _ in range(2)], ["message 1", "message 2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
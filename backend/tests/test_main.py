@@ -2,6 +2,7 @@ import unittest
 from datetime import datetime, timezone
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
+import backend.main
 from backend.main import row_to_metrics, app
 import psycopg2
 import json
@@ -14,31 +15,54 @@ MOCK_LATEST_ROW = (MOCK_TIMESTAMP, *MOCK_DB_ROW_VALUES)
 class TestBackend(unittest.TestCase):
     def setUp(self):
         self.client = TestClient(app)
+        # Each test builds its pool from the (patched) psycopg2 module
+        backend.main._db_pool = None
+        backend.main._devices_cache.update(t=0.0, v=None)
 
     @patch('backend.main.psycopg2')
     def test_get_devices_success(self, mock_psycopg2):
-        mock_conn = mock_psycopg2.connect.return_value
+        mock_conn = mock_psycopg2.pool.ThreadedConnectionPool.return_value.getconn.return_value
         mock_cur = mock_conn.cursor.return_value
         mock_cur.fetchall.return_value = [("OLIMEX_POE",)]
         
         response = self.client.get("/api/devices")
         self.assertEqual(response.status_code, 200)
         self.assertDictEqual(response.json(), {"devices": ["OLIMEX_POE"]})
+        # Read-only endpoints do not send a COMMIT
+        mock_conn.commit.assert_not_called()
+        # The connection goes back to the pool instead of being closed
+        mock_psycopg2.pool.ThreadedConnectionPool.return_value.putconn.assert_called_once_with(mock_conn)
+
+    @patch('backend.main.psycopg2')
+    def test_get_devices_cached(self, mock_psycopg2):
+        mock_conn = mock_psycopg2.pool.ThreadedConnectionPool.return_value.getconn.return_value
+        mock_cur = mock_conn.cursor.return_value
+        mock_cur.fetchall.return_value = [("OLIMEX_POE",)]
+
+        self.client.get("/api/devices")
+        response = self.client.get("/api/devices")
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(response.json(), {"devices": ["OLIMEX_POE"]})
+        # Second call is answered from the cache without touching the database
+        mock_cur.execute.assert_called_once()
 
     @patch('backend.main.psycopg2')
     def test_get_latest_data_success(self, mock_psycopg2):
-        mock_conn = mock_psycopg2.connect.return_value
+        mock_conn = mock_psycopg2.pool.ThreadedConnectionPool.return_value.getconn.return_value
         mock_cur = mock_conn.cursor.return_value
         mock_cur.fetchone.return_value = MOCK_LATEST_ROW
         
         response = self.client.get(f"/api/data/latest/{MOCK_DEVICE_ID}")
         self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["timestamp"], MOCK_TIMESTAMP.isoformat())
+        self.assertEqual(body["data"][0]["timestamp"], MOCK_TIMESTAMP.isoformat())
 
     @patch('backend.main.psycopg2')
     def test_query_data_success(self, mock_psycopg2):
-        mock_conn = mock_psycopg2.connect.return_value
+        mock_conn = mock_psycopg2.pool.ThreadedConnectionPool.return_value.getconn.return_value
         mock_cur = mock_conn.cursor.return_value
-        mock_cur.fetchall.return_value = [MOCK_LATEST_ROW]
+        mock_cur.__iter__.return_value = iter([MOCK_LATEST_ROW])
         mock_cur.fetchone.return_value = MOCK_LATEST_ROW
         mock_cur.description = [
             ('ts',), ('heat_exchanger_efficiency',), ('run_mode',), ('outdoor_temp',), 
@@ -52,6 +76,7 @@ class TestBackend(unittest.TestCase):
         query_body = {"device_id": MOCK_DEVICE_ID, "start_time": "2023-10-27T10:00:00Z", "end_time": "2023-10-27T11:00:00Z", "limit": 100}
         response = self.client.post("/api/data/query", json=query_body)
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"]), 14)
 
     @patch('backend.main.psycopg2.connect')
     def test_error_handling(self, mock_connect):
@@ -64,11 +89,22 @@ class TestBackend(unittest.TestCase):
         response = self.client.get("/api/devices")
         self.assertEqual(response.status_code, 500)  # ✅ Matches your app behavior
 
+    def test_metrics_endpoint(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("log_records_dropped", response.json())
+
     def test_row_to_metrics_conversion(self):
         ts_local = datetime(2024, 1, 1, 12, 0, 0)
         metrics = row_to_metrics(ts_local, MOCK_DB_ROW_VALUES)
         self.assertEqual(len(metrics), 14)
         self.assertEqual(metrics[0]["metric_value"], 85.5)
+        # run_mode is an INT column and keeps its integer value
+        self.assertIs(type(metrics[1]["metric_value"]), int)
+
+    def test_row_to_metrics_all_null_row(self):
+        ts_local = datetime(2024, 1, 1, 12, 0, 0)
+        self.assertEqual(row_to_metrics(ts_local, [None] * len(MOCK_DB_ROW_VALUES)), [])
 
 if __name__ == '__main__':
     unittest.main()
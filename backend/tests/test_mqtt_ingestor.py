@@ -2,69 +2,351 @@ import unittest
 from unittest.mock import patch, MagicMock
 import psycopg2
 import json
-import datetime
+import threading
+from collections import deque
 
-MOCK_NOW = datetime.datetime(2025, 12, 2, 9, 30, 0)
+from backend.tests.ilp_fakes import FakeTimestampNanos
+
+# 2025-12-02 09:30:00 UTC in epoch microseconds
+MOCK_NOW_US = 1764667800000000
 
 class TestMqttIngestor(unittest.TestCase):
 
     @patch('backend.mqtt_ingestor.time.sleep')
     @patch('backend.mqtt_ingestor.psycopg2')
     @patch('backend.mqtt_ingestor.mqtt')  # FIXED: Correct original path
-    @patch('backend.mqtt_ingestor.datetime.datetime')
-    def test_create_db_connection_retries(self, mock_dt, mock_mqtt, mock_psycopg2, mock_sleep):
-        mock_dt.now.return_value = MOCK_NOW
+    def test_create_db_pool_retries(self, mock_mqtt, mock_psycopg2, mock_sleep):
         mock_psycopg2.OperationalError = psycopg2.OperationalError
-        mock_conn = MagicMock()
-        mock_psycopg2.connect.side_effect = [
+        mock_pool = MagicMock()
+        mock_psycopg2.pool.ThreadedConnectionPool.side_effect = [
             psycopg2.OperationalError("Fail 1"),
             psycopg2.OperationalError("Fail 2"),
-            mock_conn
+            mock_pool
         ]
         
         import backend.mqtt_ingestor
-        backend.mqtt_ingestor.create_db_connection(max_retries=3)
-        self.assertEqual(mock_psycopg2.connect.call_count, 3)
+        result = backend.mqtt_ingestor.create_db_pool(max_retries=3)
+        self.assertEqual(mock_psycopg2.pool.ThreadedConnectionPool.call_count, 3)
+        self.assertIs(result, mock_pool)
 
     @patch('backend.mqtt_ingestor.time.sleep')
     @patch('backend.mqtt_ingestor.psycopg2')
     @patch('backend.mqtt_ingestor.mqtt')
-    @patch('backend.mqtt_ingestor.datetime.datetime')
-    def test_create_table_success(self, mock_dt, mock_mqtt, mock_psycopg2, mock_sleep):
-        mock_dt.now.return_value = MOCK_NOW
+    def test_create_table_success(self, mock_mqtt, mock_psycopg2, mock_sleep):
         import backend.mqtt_ingestor
         ingestor = backend.mqtt_ingestor
         
-        mock_conn = MagicMock()
-        mock_cur = mock_conn.cursor.return_value
-        ingestor.conn = mock_conn
+        mock_pool = MagicMock()
+        mock_conn = mock_pool.getconn.return_value
         
-        ingestor.create_table(mock_cur)
-        mock_conn.commit.assert_called_once()
+        ingestor.create_table(mock_pool)
+        mock_conn.cursor.return_value.__enter__.return_value.execute.assert_called_once_with(ingestor.OLIMEX_TABLE_SCHEMA)
+        # The DDL runs in autocommit; the pooled connection is handed back in transaction mode
+        mock_conn.commit.assert_not_called()
+        self.assertFalse(mock_conn.autocommit)
+        mock_pool.putconn.assert_called_once_with(mock_conn)
 
+    @patch('backend.mqtt_ingestor.Sender', None)  # PG wire path, even with the questdb client installed
+    @patch('backend.mqtt_ingestor.execute_values')
     @patch('backend.mqtt_ingestor.time.sleep')
     @patch('backend.mqtt_ingestor.psycopg2')
     @patch('backend.mqtt_ingestor.mqtt')
-    @patch('backend.mqtt_ingestor.datetime.datetime')
-    def test_on_message_success_and_sql_generation(self, mock_dt, mock_mqtt, mock_psycopg2, mock_sleep):
-        mock_dt.now.return_value = MOCK_NOW
+    @patch('backend.mqtt_ingestor.time.time_ns', return_value=MOCK_NOW_US * 1000)
+    def test_on_message_success_and_sql_generation(self, mock_time_ns, mock_mqtt, mock_psycopg2, mock_sleep, mock_execute_values):
         import backend.mqtt_ingestor
         ingestor = backend.mqtt_ingestor
         
-        mock_conn = MagicMock()
-        mock_cur = mock_conn.cursor.return_value
-        ingestor.conn = mock_conn
-        ingestor.cur = mock_cur
+        mock_pool = MagicMock()
+        mock_conn = mock_pool.getconn.return_value
+        ingestor.db_pool = mock_pool
+        ingestor._buffer.clear()
         
         TEST_TOPIC = "sensors/air/unit/OLIMEX_POE"
         TEST_PAYLOAD = {"heat_exchanger_efficiency": 88.0, "outdoor_temp": 25.5, "extra_value": "test"}
         mock_msg = MagicMock()
         mock_msg.topic = TEST_TOPIC
-        mock_msg.payload.decode.return_value = json.dumps(TEST_PAYLOAD)
+        mock_msg.payload = json.dumps(TEST_PAYLOAD).encode()
         
         ingestor.on_message(None, None, mock_msg)
-        mock_cur.execute.assert_called()
+        ingestor.on_message(None, None, mock_msg)
+        # Rows are buffered, not written per message
+        mock_execute_values.assert_not_called()
+
+        ingestor.flush_buffer()
+        mock_execute_values.assert_called_once()
+        sql, rows = mock_execute_values.call_args[0][1:3]
+        self.assertEqual(sql, ingestor._INSERT_SQL)
+        self.assertEqual(mock_execute_values.call_args[1]['template'], ingestor._INSERT_TEMPLATE)
+        # Fixed column order: unknown keys are ignored, missing fields become NULL
+        expected = [MOCK_NOW_US, "OLIMEX_POE"] + [None] * len(ingestor._FIELDS)
+        expected[2 + ingestor._FIELDS.index("heat_exchanger_efficiency")] = 88.0
+        expected[2 + ingestor._FIELDS.index("outdoor_temp")] = 25.5
+        self.assertEqual(rows, [tuple(expected)] * 2)
+        mock_conn.commit.assert_called_once()
+        mock_pool.putconn.assert_called_once_with(mock_conn, close=False)
+
+    @patch('backend.mqtt_ingestor.Sender', None)
+    @patch('backend.mqtt_ingestor.execute_values')
+    @patch('backend.mqtt_ingestor.psycopg2')
+    def test_batch_size_wakes_flusher_thread(self, mock_psycopg2, mock_execute_values):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        written = threading.Event()
+        mock_pool = MagicMock()
+        mock_conn = mock_pool.getconn.return_value
+        mock_conn.commit.side_effect = written.set
+        ingestor.db_pool = mock_pool
+        ingestor._buffer.clear()
+
+        mock_msg = MagicMock()
+        mock_msg.topic = "sensors/device_1"
+        mock_msg.payload = json.dumps({"outdoor_temp": 1.0}).encode()
+
+        with patch.object(ingestor, 'FLUSH_INTERVAL', 60), patch.object(ingestor, 'FLUSH_SIZE', 3):
+            ingestor.start_flusher()
+            try:
+                for _ in range(3):
+                    ingestor.on_message(None, None, mock_msg)
+                # The batch is written by the flusher thread, not by on_message itself
+                self.assertTrue(written.wait(2))
+            finally:
+                ingestor.stop_flusher()
+
+        mock_execute_values.assert_called_once()
+        self.assertEqual(len(mock_execute_values.call_args[0][2]), 3)
         mock_conn.commit.assert_called_once()
+        self.assertEqual(len(ingestor._buffer), 0)
+
+    def test_on_message_ignores_invalid_payload(self):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+        ingestor._buffer.clear()
+
+        mock_msg = MagicMock()
+        mock_msg.topic = "sensors/device_1"
+        for payload in (b"{not json", b"[1, 2]"):
+            mock_msg.payload = payload
+            ingestor.on_message(None, None, mock_msg)
+
+        self.assertEqual(len(ingestor._buffer), 0)
+
+    def test_on_message_nulls_invalid_values(self):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+        ingestor._buffer.clear()
+
+        mock_msg = MagicMock()
+        mock_msg.topic = "sensors/device_1"
+        mock_msg.payload = json.dumps({
+            "outdoor_temp": "n/a",
+            "supply_air_temp": {"value": 20},
+            "extract_air_temp": "21.5",
+            "run_mode": 2.0,
+        }).encode()
+        ingestor.on_message(None, None, mock_msg)
+
+        row = ingestor._buffer.pop()
+        values = dict(zip(ingestor._FIELDS, row[2:]))
+        # Bad values become NULL; the rest of the row is kept with the column's type
+        self.assertIsNone(values["outdoor_temp"])
+        self.assertIsNone(values["supply_air_temp"])
+        self.assertEqual(values["extract_air_temp"], 21.5)
+        self.assertIs(type(values["run_mode"]), int)
+
+    def test_on_message_nulls_out_of_range_and_fractional_integers(self):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+        ingestor._buffer.clear()
+
+        mock_msg = MagicMock()
+        mock_msg.topic = "sensors/device_1"
+        cases = [
+            ({"run_mode": 3e9}, "run_mode", None),                          # beyond INT
+            ({"run_mode": -(2**31)}, "run_mode", None),                     # INT NULL sentinel
+            ({"run_mode": 2.7}, "run_mode", None),                          # would be truncated
+            ({"run_mode": 2**31 - 1}, "run_mode", 2**31 - 1),               # INT maximum
+            ({"supply_air_fan_runtime": 2**63}, "supply_air_fan_runtime", None),  # beyond LONG
+            ({"supply_air_fan_runtime": 3e9}, "supply_air_fan_runtime", 3_000_000_000),  # fits LONG
+        ]
+        for payload, field, expected in cases:
+            with self.subTest(payload=payload):
+                mock_msg.payload = json.dumps(payload).encode()
+                ingestor.on_message(None, None, mock_msg)
+                row = ingestor._buffer.pop()
+                self.assertEqual(row[2 + ingestor._FIELDS.index(field)], expected)
+
+    def test_full_buffer_drops_oldest(self):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        mock_msg = MagicMock()
+        mock_msg.topic = "sensors/device_1"
+        dropped_before = ingestor.dropped_rows
+        with patch.object(ingestor, '_buffer', deque(maxlen=2)):
+            for i in range(3):
+                mock_msg.payload = json.dumps({"run_mode": i}).encode()
+                ingestor.on_message(None, None, mock_msg)
+            run_modes = [row[2 + ingestor._FIELDS.index("run_mode")] for row in ingestor._buffer]
+
+        self.assertEqual(run_modes, [1, 2])
+        self.assertEqual(ingestor.dropped_rows - dropped_before, 1)
+
+    @patch('backend.mqtt_ingestor.Sender', None)
+    @patch('backend.mqtt_ingestor.execute_values')
+    def test_flush_retries_on_fresh_connection(self, mock_execute_values):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        mock_pool = MagicMock()
+        dead_conn, live_conn = MagicMock(), MagicMock()
+        mock_pool.getconn.side_effect = [dead_conn, live_conn]
+        mock_execute_values.side_effect = [psycopg2.OperationalError("server closed the connection"), None]
+        ingestor.db_pool = mock_pool
+        ingestor._buffer.clear()
+        ingestor._buffer.append((MOCK_NOW_US, "device_1") + (None,) * len(ingestor._FIELDS))
+
+        ingestor.flush_buffer()
+
+        # The broken connection is discarded and the batch is written on a new one
+        mock_pool.putconn.assert_any_call(dead_conn, close=True)
+        mock_pool.putconn.assert_any_call(live_conn, close=False)
+        live_conn.commit.assert_called_once()
+
+    @patch('backend.mqtt_ingestor.Sender', None)
+    @patch('backend.mqtt_ingestor.execute_values')
+    def test_unreachable_db_keeps_rows_buffered(self, mock_execute_values):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        mock_pool = MagicMock()
+        mock_pool.getconn.side_effect = psycopg2.OperationalError("QuestDB is down")
+        ingestor.db_pool = mock_pool
+        ingestor._buffer.clear()
+        dropped_before = ingestor.dropped_rows
+        for i in range(5):
+            ingestor._buffer.append((MOCK_NOW_US + i, "device_1") + (None,) * len(ingestor._FIELDS))
+
+        self.assertFalse(ingestor.flush_buffer())
+        self.assertEqual(len(ingestor._buffer), 5)
+        self.assertEqual(ingestor.dropped_rows, dropped_before)
+
+        # Once QuestDB is back, the kept rows are written by the next flush
+        mock_pool.getconn.side_effect = None
+        self.assertTrue(ingestor.flush_buffer())
+        rows = mock_execute_values.call_args[0][2]
+        self.assertEqual([row[0] for row in rows], [MOCK_NOW_US + i for i in range(5)])
+        self.assertEqual(len(ingestor._buffer), 0)
+
+    @patch('backend.mqtt_ingestor.Sender', None)
+    def test_outage_drops_oldest_beyond_buffer_size(self):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        mock_pool = MagicMock()
+        mock_pool.getconn.side_effect = psycopg2.OperationalError("QuestDB is down")
+        ingestor.db_pool = mock_pool
+        dropped_before = ingestor.dropped_rows
+        row = lambda i: (MOCK_NOW_US + i, "device_1") + (None,) * len(ingestor._FIELDS)
+        with patch.object(ingestor, '_buffer', deque(maxlen=3)):
+            ingestor._store(row(0))
+            ingestor._store(row(1))
+            ingestor.flush_buffer()
+            ingestor._store(row(2))
+            ingestor._store(row(3))
+            kept = [r[0] - MOCK_NOW_US for r in ingestor._buffer]
+
+        self.assertEqual(kept, [1, 2, 3])
+        self.assertEqual(ingestor.dropped_rows - dropped_before, 1)
+
+    @patch('backend.mqtt_ingestor.Sender', None)
+    def test_stop_flusher_counts_unsent_rows(self):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        mock_pool = MagicMock()
+        mock_pool.getconn.side_effect = psycopg2.OperationalError("QuestDB is down")
+        ingestor.db_pool = mock_pool
+        ingestor._buffer.clear()
+        dropped_before = ingestor.dropped_rows
+        ingestor._buffer.append((MOCK_NOW_US, "device_1") + (None,) * len(ingestor._FIELDS))
+
+        with patch.object(ingestor, '_flush_thread', None):
+            ingestor.stop_flusher()
+
+        self.assertEqual(ingestor.dropped_rows - dropped_before, 1)
+        self.assertEqual(len(ingestor._buffer), 0)
+
+    @patch('backend.mqtt_ingestor.TimestampNanos', FakeTimestampNanos)
+    @patch('backend.mqtt_ingestor.Sender')
+    def test_failed_ilp_send_keeps_rows(self, mock_sender_cls):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        mock_sender = mock_sender_cls.from_conf.return_value
+        mock_sender.flush.side_effect = [OSError("connection reset"), None]
+        ingestor._buffer.clear()
+        ingestor._buffer.append((MOCK_NOW_US, "device_1") + (None,) * len(ingestor._FIELDS))
+
+        try:
+            self.assertFalse(ingestor.flush_buffer())
+            self.assertEqual(len(ingestor._buffer), 1)
+            self.assertTrue(ingestor.flush_buffer())
+            self.assertEqual(len(ingestor._buffer), 0)
+        finally:
+            ingestor._close_sender()
+
+    @patch('backend.mqtt_ingestor.TimestampNanos', FakeTimestampNanos)
+    @patch('backend.mqtt_ingestor.Sender')
+    @patch('backend.mqtt_ingestor.execute_values')
+    def test_flush_uses_ilp_when_available(self, mock_execute_values, mock_sender_cls):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        mock_sender = mock_sender_cls.from_conf.return_value
+        values = [None] * len(ingestor._FIELDS)
+        values[ingestor._FIELDS.index("outdoor_temp")] = 5.0
+        values[ingestor._FIELDS.index("run_mode")] = 1
+        ingestor._buffer.clear()
+        ingestor._buffer.append((MOCK_NOW_US, "device_1", *values))
+
+        try:
+            ingestor.flush_buffer()
+        finally:
+            ingestor._close_sender()
+
+        mock_sender_cls.from_conf.assert_called_once_with("tcp::addr=localhost:9009;")
+        args, kwargs = mock_sender.row.call_args
+        self.assertEqual(args[0], 'olimex_data')
+        self.assertEqual(kwargs['symbols'], {'device_id': 'device_1'})
+        # NULLs are left out
+        self.assertEqual(kwargs['columns'], {'run_mode': 1, 'outdoor_temp': 5.0})
+        self.assertIsInstance(kwargs['at'], FakeTimestampNanos)
+        self.assertEqual(kwargs['at'].value, MOCK_NOW_US * 1000)
+        mock_sender.flush.assert_called_once()
+        mock_execute_values.assert_not_called()
+
+    @patch('backend.mqtt_ingestor.TimestampNanos', FakeTimestampNanos)
+    @patch('backend.mqtt_ingestor.Sender')
+    def test_ilp_rejected_row_does_not_drop_batch(self, mock_sender_cls):
+        import backend.mqtt_ingestor
+        ingestor = backend.mqtt_ingestor
+
+        mock_sender = mock_sender_cls.from_conf.return_value
+        mock_sender.row.side_effect = [None, ValueError("bad row"), None]
+        ingestor._buffer.clear()
+        for device in ("device_1", "device_2", "device_3"):
+            ingestor._buffer.append((MOCK_NOW_US, device) + (None,) * len(ingestor._FIELDS))
+
+        try:
+            ingestor.flush_buffer()
+            # The connection is kept: only the rejected row was skipped
+            self.assertIs(ingestor._sender, mock_sender)
+        finally:
+            ingestor._close_sender()
+
+        self.assertEqual(mock_sender.row.call_count, 3)
+        mock_sender.flush.assert_called_once()
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,13 +5,34 @@ Tests all components: Mosquitto, QuestDB, Backend, Grafana
 Run with: python3 test_system.py
 """
 
+import io
+import os
 import sys
 import time
 import json
+import errno
+import asyncio
+import argparse
 import socket
-from datetime import datetime
+import struct
+import selectors
+import threading
+import subprocess
+import importlib.util
 from typing import Dict, Tuple
 
+try:
+    # Optional: QuestDB's ILP client; without it the insert check uses the PG wire
+    from questdb.ingress import Sender, TimestampNanos
+except ImportError:
+    Sender = None
+    TimestampNanos = None
+
+# Client libraries are only looked up here; they are imported once a check knows
+# its service is listening, so a dead service costs no import
+_HAS_PAHO = importlib.util.find_spec("paho") is not None
+_HAS_PG = importlib.util.find_spec("psycopg2") is not None
+
 # Color codes for terminal output
 GREEN = '\033[92m'
 RED = '\033[91m'
@@ -19,51 +40,240 @@ YELLOW = '\033[93m'
 BLUE = '\033[94m'
 RESET = '\033[0m'
 
+# Pre-formatted colored prefixes per status, so print_test only concatenates
+STATUS_PREFIX = {"PASS": f"{GREEN}✓{RESET} ", "FAIL": f"{RED}✗{RESET} ", "WARN": f"{YELLOW}⚠{RESET} "}
+MSG_PREFIX = {"PASS": "  → ", "FAIL": f"  → {RED}", "WARN": f"  → {YELLOW}"}
+MSG_SUFFIX = {"PASS": "", "FAIL": RESET, "WARN": RESET}
+
+# (host, port, service name) probed together at the start of a run
+PORT_TARGETS = [
+    ("localhost", 1883, "Mosquitto MQTT"),
+    ("localhost", 9000, "QuestDB Web UI"),
+    ("localhost", 8812, "QuestDB PostgreSQL"),
+    ("localhost", 3000, "Grafana"),
+    ("localhost", 9009, "QuestDB ILP"),
+]
+PORT_TIMEOUT = 2.0
+# SO_LINGER on with a zero timeout: close() aborts the probe connection with a RST
+# instead of a FIN/TIME_WAIT teardown, so no probe socket lingers after the check
+_LINGER_RST = struct.pack("ii", 1, 0)
+
+# Max seconds to wait for each MQTT callback (connect, subscribe, message)
+MQTT_TIMEOUT = 5.0
+
+# Columns the sensors table must have
+EXPECTED_SENSOR_COLUMNS = frozenset(('ts', 'device_id', 'temperature', 'humidity', 'soil_moisture', 'energy'))
+
+# Rows written by the QuestDB insert check
+TEST_ROWS = 100
+# ts is sent as epoch microseconds and cast by QuestDB
+INSERT_TEMPLATE = "(%s::TIMESTAMP, %s, %s, %s, %s, %s)"
+# ILP rows are committed asynchronously, so the read-back waits up to this long
+ILP_VISIBLE_TIMEOUT = 2.0
+
+# Queries shared by the QuestDB insert and data flow checks
+COUNT_SQL = "SELECT COUNT(*) FROM sensors WHERE device_id = %s"
+DELETE_SQL = "DELETE FROM sensors WHERE device_id = %s"
+
+class CheckResult:
+    """Outcome of a single check (slots instead of a dict per result)"""
+    __slots__ = ("test", "status", "message")
+    
+    def __init__(self, test, status, message=""):
+        self.test = test
+        self.status = status
+        self.message = message
+
+
 class SystemTester:
-    def __init__(self):
+    def __init__(self, stream=False):
+        # By default output is collected and written in one go at the end;
+        # stream=True prints each line as it is produced (interactive use)
+        self._stream = stream
+        self._buffer = io.StringIO()
         self.passed = 0
         self.failed = 0
         self.warnings = 0
         self.results = []
+        # Counters/results are updated from several worker threads
+        self._lock = threading.Lock()
+        # Per-thread output buffer, so concurrent tests don't interleave their lines
+        self._local = threading.local()
+        # (host, port) -> open, filled by check_ports_batch
+        self._port_status = {}
+        # QuestDB connection shared by test_questdb and test_data_flow
+        self._qdb_conn = None
+        # MQTT client shared by test_mqtt_broker and test_data_flow
+        self._mqtt = None
+        self._mqtt_connected = threading.Event()
+        # Results of the prerequisite checks for test_data_flow (None = not run)
+        self._mqtt_ok = None
+        self._qdb_ok = None
+        
+    def _out(self, text=""):
+        """Print a line, or buffer it when running inside a concurrent test"""
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is not None:
+            buffer.append(text)
+        elif self._stream:
+            print(text)
+        else:
+            self._buffer.write(text)
+            self._buffer.write("\n")
+    
+    def flush_output(self):
+        """Write all collected output to stdout with a single write"""
+        output = self._buffer.getvalue()
+        if output:
+            sys.stdout.write(output)
+            self._buffer = io.StringIO()
+        sys.stdout.flush()
         
     def print_header(self, text):
         """Print section header"""
-        print(f"\n{BLUE}{'='*60}")
-        print(f"  {text}")
-        print(f"{'='*60}{RESET}\n")
+        self._out(f"\n{BLUE}{'='*60}")
+        self._out(f"  {text}")
+        self._out(f"{'='*60}{RESET}\n")
         
     def print_test(self, name, status, message=""):
         """Print test result"""
-        if status == "PASS":
-            print(f"{GREEN}✓{RESET} {name}")
-            if message:
-                print(f"  → {message}")
-            self.passed += 1
-        elif status == "FAIL":
-            print(f"{RED}✗{RESET} {name}")
-            if message:
-                print(f"  → {RED}{message}{RESET}")
-            self.failed += 1
-        elif status == "WARN":
-            print(f"{YELLOW}⚠{RESET} {name}")
+        prefix = STATUS_PREFIX.get(status)
+        if prefix is not None:
+            self._out(prefix + name)
             if message:
-                print(f"  → {YELLOW}{message}{RESET}")
-            self.warnings += 1
+                self._out(MSG_PREFIX[status] + message + MSG_SUFFIX[status])
         
-        self.results.append({
-            "test": name,
-            "status": status,
-            "message": message
-        })
+        with self._lock:
+            if status == "PASS":
+                self.passed += 1
+            elif status == "FAIL":
+                self.failed += 1
+            elif status == "WARN":
+                self.warnings += 1
+            self.results.append(CheckResult(name, status, message))
     
-    def check_port(self, host, port, service_name):
-        """Check if a port is open"""
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)
-        result = sock.connect_ex((host, port))
-        sock.close()
+    def _run_buffered(self, test):
+        """Run one test with its output collected; returns (result, lines)"""
+        self._local.buffer = lines = []
+        try:
+            return test(), lines
+        finally:
+            self._local.buffer = None
+    
+    def _get_qdb(self):
+        """Return the shared QuestDB connection, opening it on first use"""
+        if self._qdb_conn is None or self._qdb_conn.closed:
+            import psycopg2
+            self._qdb_conn = psycopg2.connect(
+                dbname="qdb",
+                user="admin",
+                password="quest",
+                host="localhost",
+                port=8812,
+                application_name="system_test"
+            )
+        return self._qdb_conn
+    
+    def _insert_ilp(self, rows):
+        """Write test rows to the sensors table over QuestDB's ILP/TCP port"""
+        with Sender.from_conf("tcp::addr=localhost:9009;") as sender:
+            for ts, device_id, temperature, humidity, soil_moisture, energy in rows:
+                sender.row(
+                    "sensors",
+                    symbols={"device_id": device_id},
+                    columns={
+                        "temperature": temperature,
+                        "humidity": humidity,
+                        "soil_moisture": soil_moisture,
+                        "energy": energy,
+                    },
+                    at=TimestampNanos(ts * 1000),
+                )
+            # Leaving the block flushes the buffered rows
+    
+    def _close_qdb(self):
+        """Close the shared QuestDB connection"""
+        if self._qdb_conn is not None:
+            self._qdb_conn.close()
+            self._qdb_conn = None
+    
+    def _get_mqtt(self):
+        """Return the shared MQTT client, connecting it on first use"""
+        if self._mqtt is None:
+            import paho.mqtt.client as mqtt
+            
+            def on_connect(client, userdata, flags, rc):
+                if rc == 0:
+                    self._mqtt_connected.set()
+            
+            client = mqtt.Client(client_id="system_test")
+            client.username_pw_set("edgeuser", "Optilogic25")
+            client.on_connect = on_connect
+            # No loop_start(): the short checks drive the socket inline via _mqtt_pump
+            client.connect("localhost", 1883, 60)
+            self._mqtt = client
+        return self._mqtt
+    
+    def _mqtt_pump(self, done, timeout=MQTT_TIMEOUT):
+        """Run the shared client's network loop until done() is true or timeout; returns done()"""
+        deadline = time.monotonic() + timeout
+        while not done() and time.monotonic() < deadline:
+            self._mqtt.loop(timeout=0.1)
+        return done()
+    
+    def _close_mqtt(self):
+        """Disconnect the shared MQTT client"""
+        if self._mqtt is not None:
+            self._mqtt.disconnect()
+            self._mqtt = None
+            self._mqtt_connected.clear()
+    
+    def check_ports_batch(self, targets, timeout=PORT_TIMEOUT):
+        """Probe all ports at once with non-blocking connects; returns {(host, port): open}"""
+        status = {}
+        sel = selectors.DefaultSelector()
+        for host, port, _ in targets:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RST)
+            sock.setblocking(False)
+            result = sock.connect_ex((host, port))
+            if result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sel.register(sock, selectors.EVENT_WRITE, (host, port))
+            else:
+                status[(host, port)] = result == 0
+                sock.close()
+        
+        # One select loop for every pending connect instead of a timeout per port
+        deadline = time.monotonic() + timeout
+        while sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                sock = key.fileobj
+                status[key.data] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                sel.unregister(sock)
+                sock.close()
         
-        if result == 0:
+        # Whatever has not answered by now counts as closed
+        for key in list(sel.get_map().values()):
+            status[key.data] = False
+            sel.unregister(key.fileobj)
+            key.fileobj.close()
+        sel.close()
+        return status
+    
+    def _port_open(self, host, port):
+        """Return the batched probe result for a port, probing it if not yet known"""
+        is_open = self._port_status.get((host, port))
+        if is_open is None:
+            is_open = self.check_ports_batch([(host, port, "")])[(host, port)]
+            self._port_status[(host, port)] = is_open
+        return is_open
+    
+    def check_port(self, host, port, service_name):
+        """Check if a port is open (uses the batched probe result when available)"""
+        if self._port_open(host, port):
             self.print_test(f"{service_name} port {port}", "PASS", f"Port is open on {host}")
             return True
         else:
@@ -75,34 +285,23 @@ class SystemTester:
         self.print_header("Testing MQTT Broker (Mosquitto)")
         
         try:
-            import paho.mqtt.client as mqtt
-            
-            # Check MQTT port
+            # Check MQTT port before importing paho, so a dead broker costs no import
             mqtt_running = self.check_port("localhost", 1883, "Mosquitto MQTT")
             
             if not mqtt_running:
                 self.print_test("Mosquitto Connection", "FAIL", "MQTT broker not running")
                 return False
             
-            # Test MQTT connection with authentication
-            connected = {"status": False}
-            
-            def on_connect(client, userdata, flags, rc):
-                if rc == 0:
-                    connected["status"] = True
-                    client.disconnect()
-            
-            client = mqtt.Client(client_id="system_test")
-            client.username_pw_set("edgeuser", "Optilogic25")
-            client.on_connect = on_connect
+            if not _HAS_PAHO:
+                self.print_test("MQTT Test", "FAIL", "paho-mqtt not installed. Run: pip install paho-mqtt")
+                return False
             
+            # Test MQTT connection with authentication
+            # The pump returns as soon as the callback has fired instead of fixed sleeps
             try:
-                client.connect("localhost", 1883, 60)
-                client.loop_start()
-                time.sleep(2)
-                client.loop_stop()
+                client = self._get_mqtt()
                 
-                if connected["status"]:
+                if self._mqtt_pump(self._mqtt_connected.is_set):
                     self.print_test("MQTT Authentication", "PASS", "Connected with edgeuser credentials")
                 else:
                     self.print_test("MQTT Authentication", "FAIL", "Could not authenticate")
@@ -114,26 +313,29 @@ class SystemTester:
             
             # Test publish/subscribe
             received = {"data": None}
+            subscribed = threading.Event()
+            received_evt = threading.Event()
+            
+            def on_subscribe(client, userdata, mid, granted_qos):
+                subscribed.set()
             
             def on_message(client, userdata, msg):
                 received["data"] = msg.payload.decode()
+                received_evt.set()
             
-            test_client = mqtt.Client(client_id="test_pubsub")
-            test_client.username_pw_set("edgeuser", "Optilogic25")
-            test_client.on_message = on_message
+            # Same connected client; subscribe/message callbacks only for this check
+            client.on_subscribe = on_subscribe
+            client.on_message = on_message
             
             try:
-                test_client.connect("localhost", 1883, 60)
-                test_client.subscribe("test/system")
-                test_client.loop_start()
-                time.sleep(1)
+                client.subscribe("test/system")
+                self._mqtt_pump(subscribed.is_set)
                 
                 # Publish test message
-                test_client.publish("test/system", "test_message")
-                time.sleep(2)
+                client.publish("test/system", "test_message")
+                self._mqtt_pump(received_evt.is_set)
                 
-                test_client.loop_stop()
-                test_client.disconnect()
+                client.unsubscribe("test/system")
                 
                 if received["data"] == "test_message":
                     self.print_test("MQTT Pub/Sub", "PASS", "Message sent and received successfully")
@@ -146,9 +348,6 @@ class SystemTester:
             
             return True
             
-        except ImportError:
-            self.print_test("MQTT Test", "FAIL", "paho-mqtt not installed. Run: pip install paho-mqtt")
-            return False
         except Exception as e:
             self.print_test("MQTT Test", "FAIL", str(e))
             return False
@@ -158,9 +357,7 @@ class SystemTester:
         self.print_header("Testing QuestDB Database")
         
         try:
-            import psycopg2
-            
-            # Check QuestDB ports
+            # Check QuestDB ports before loading the psycopg2 C extension
             web_ui = self.check_port("localhost", 9000, "QuestDB Web UI")
             postgres = self.check_port("localhost", 8812, "QuestDB PostgreSQL")
             
@@ -168,65 +365,75 @@ class SystemTester:
                 self.print_test("QuestDB Connection", "FAIL", "QuestDB not running")
                 return False
             
+            if not _HAS_PG:
+                self.print_test("QuestDB Test", "FAIL", "psycopg2 not installed. Run: pip install psycopg2-binary")
+                return False
+            
+            import psycopg2
+            from psycopg2.extras import execute_values
+            
             # Test database connection
             try:
-                conn = psycopg2.connect(
-                    dbname="qdb",
-                    user="admin",
-                    password="quest",
-                    host="localhost",
-                    port=8812
-                )
+                conn = self._get_qdb()
                 self.print_test("QuestDB Connection", "PASS", "Connected to database")
                 
                 cur = conn.cursor()
                 
-                # Check if sensors table exists
+                # One query answers both "does the sensors table exist" (any rows)
+                # and "which columns does it have"
                 cur.execute("""
-                    SELECT table_name FROM information_schema.tables 
+                    SELECT column_name
+                    FROM information_schema.columns 
                     WHERE table_name = 'sensors'
                 """)
-                table_exists = cur.fetchone()
+                found_columns = {col[0] for col in cur.fetchall()}
                 
-                if table_exists:
+                if found_columns:
                     self.print_test("Sensors Table", "PASS", "Table exists")
                     
                     # Check table structure
-                    cur.execute("""
-                        SELECT column_name, data_type 
-                        FROM information_schema.columns 
-                        WHERE table_name = 'sensors'
-                    """)
-                    columns = cur.fetchall()
-                    
-                    expected_columns = ['ts', 'device_id', 'temperature', 'humidity', 'soil_moisture', 'energy']
-                    found_columns = [col[0] for col in columns]
-                    
-                    missing_columns = set(expected_columns) - set(found_columns)
+                    missing_columns = EXPECTED_SENSOR_COLUMNS - found_columns
                     if missing_columns:
-                        self.print_test("Table Structure", "WARN", f"Missing columns: {missing_columns}")
+                        self.print_test("Table Structure", "WARN", f"Missing columns: {', '.join(sorted(missing_columns))}")
                     else:
                         self.print_test("Table Structure", "PASS", "All expected columns present")
                     
                     # Test insert
                     try:
-                        test_ts = datetime.now()
-                        cur.execute("""
-                            INSERT INTO sensors (ts, device_id, temperature, humidity, soil_moisture, energy)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                        """, (test_ts, 'TEST_DEVICE', 25.0, 60.0, 50.0, 1.5))
-                        conn.commit()
-                        self.print_test("Data Insert", "PASS", "Successfully inserted test data")
+                        # Epoch microseconds (same as the ingestor), cast to TIMESTAMP by
+                        # QuestDB, so no datetime object is built and formatted per row
+                        test_ts_us = time.time_ns() // 1000
+                        # TEST_ROWS rows in one multi-row INSERT instead of one round-trip per row
+                        rows = [
+                            (test_ts_us + i * 1000, 'TEST_DEVICE', 25.0 + i % 5, 60.0, 50.0, 1.5)
+                            for i in range(TEST_ROWS)
+                        ]
+                        use_ilp = Sender is not None and self._port_open("localhost", 9009)
+                        if use_ilp:
+                            self._insert_ilp(rows)
+                            self.print_test("Data Insert", "PASS", f"Successfully inserted {len(rows)} test rows over ILP")
+                        else:
+                            execute_values(cur, """
+                                INSERT INTO sensors (ts, device_id, temperature, humidity, soil_moisture, energy)
+                                VALUES %s
+                            """, rows, template=INSERT_TEMPLATE, page_size=TEST_ROWS)
+                            conn.commit()
+                            self.print_test("Data Insert", "PASS", f"Successfully inserted {len(rows)} test rows")
                         
-                        # Test query
-                        cur.execute("SELECT COUNT(*) FROM sensors WHERE device_id = 'TEST_DEVICE'")
-                        count = cur.fetchone()[0]
+                        # Test query (still over PG; ILP rows may need a moment to become visible)
+                        deadline = time.monotonic() + (ILP_VISIBLE_TIMEOUT if use_ilp else 0)
+                        while True:
+                            cur.execute(COUNT_SQL, ('TEST_DEVICE',))
+                            count = cur.fetchone()[0]
+                            if count >= len(rows) or time.monotonic() >= deadline:
+                                break
+                            time.sleep(0.1)
                         
-                        if count > 0:
+                        if count >= len(rows):
                             self.print_test("Data Query", "PASS", f"Found {count} test record(s)")
                             
                             # Clean up test data
-                            cur.execute("DELETE FROM sensors WHERE device_id = 'TEST_DEVICE'")
+                            cur.execute(DELETE_SQL, ('TEST_DEVICE',))
                             conn.commit()
                             self.print_test("Data Cleanup", "PASS", "Test data removed")
                         else:
@@ -240,16 +447,14 @@ class SystemTester:
                     return False
                 
                 cur.close()
-                conn.close()
+                # Keep the connection for the data flow test; just end the transaction
+                conn.rollback()
                 return True
                 
             except psycopg2.OperationalError as e:
                 self.print_test("QuestDB Connection", "FAIL", str(e))
                 return False
                 
-        except ImportError:
-            self.print_test("QuestDB Test", "FAIL", "psycopg2 not installed. Run: pip install psycopg2-binary")
-            return False
         except Exception as e:
             self.print_test("QuestDB Test", "FAIL", str(e))
             return False
@@ -273,10 +478,14 @@ class SystemTester:
         self.print_header("Testing Docker Containers")
         
         try:
-            import subprocess
+            containers = ['mosquitto', 'questdb', 'grafana']
             
-            # Check if docker is running
-            result = subprocess.run(['docker', 'ps'], capture_output=True, text=True)
+            # Check if docker is running; Docker filters the containers and prints only their names
+            cmd = ['docker', 'ps', '--format', '{{.Names}}']
+            for container in containers:
+                cmd += ['--filter', f'name={container}']
+            # Raw bytes: only name membership is checked, so stdout is never decoded
+            result = subprocess.run(cmd, capture_output=True)
             
             if result.returncode != 0:
                 self.print_test("Docker Status", "FAIL", "Docker not running or not installed")
@@ -284,12 +493,11 @@ class SystemTester:
             
             self.print_test("Docker Status", "PASS", "Docker is running")
             
-            # Check for expected containers
-            containers = ['mosquitto', 'questdb', 'grafana']
-            output = result.stdout
+            # Check for expected containers (exact names from docker-compose.yml)
+            running = set(result.stdout.split())
             
             for container in containers:
-                if container in output:
+                if container.encode() in running:
                     self.print_test(f"{container.capitalize()} Container", "PASS", "Container is running")
                 else:
                     self.print_test(f"{container.capitalize()} Container", "WARN", 
@@ -308,32 +516,31 @@ class SystemTester:
         """Test complete data flow: MQTT -> QuestDB"""
         self.print_header("Testing Complete Data Flow")
         
+        # The broker/QuestDB checks already reported why; don't connect again
+        if self._mqtt_ok is False or self._qdb_ok is False:
+            self.print_test("Data Flow", "WARN", "Skipped - MQTT or QuestDB check failed")
+            return False
+        
+        # Both ends must be reachable; skip before psycopg2/paho are imported if not
+        if not (self._port_open("localhost", 8812) and self._port_open("localhost", 1883)):
+            self.print_test("Data Flow Test", "FAIL", "QuestDB or MQTT broker not running")
+            return False
+        
         try:
-            import paho.mqtt.client as mqtt
-            import psycopg2
-            
             # Connect to QuestDB
-            conn = psycopg2.connect(
-                dbname="qdb",
-                user="admin",
-                password="quest",
-                host="localhost",
-                port=8812
-            )
+            conn = self._get_qdb()
             cur = conn.cursor()
             
             # Get current count
-            cur.execute("SELECT COUNT(*) FROM sensors WHERE device_id = 'FLOW_TEST'")
+            cur.execute(COUNT_SQL, ('FLOW_TEST',))
             initial_count = cur.fetchone()[0]
             
-            # Publish test data via MQTT
-            client = mqtt.Client(client_id="flow_test")
-            client.username_pw_set("edgeuser", "Optilogic25")
-            client.connect("localhost", 1883, 60)
+            # Publish test data via MQTT (reusing the broker check's connection)
+            client = self._get_mqtt()
             
             test_payload = "FLOW_TEST:123"
-            client.publish("sensors/test", test_payload)
-            client.disconnect()
+            info = client.publish("sensors/test", test_payload)
+            self._mqtt_pump(info.is_published)
             
             self.print_test("Data Published", "PASS", f"Sent: {test_payload}")
             
@@ -341,7 +548,7 @@ class SystemTester:
             time.sleep(3)
             
             # Check if data arrived in QuestDB
-            cur.execute("SELECT COUNT(*) FROM sensors WHERE device_id = 'FLOW_TEST'")
+            cur.execute(COUNT_SQL, ('FLOW_TEST',))
             final_count = cur.fetchone()[0]
             
             if final_count > initial_count:
@@ -349,26 +556,44 @@ class SystemTester:
                               f"Data successfully flowed: MQTT → Backend → QuestDB")
                 
                 # Clean up
-                cur.execute("DELETE FROM sensors WHERE device_id = 'FLOW_TEST'")
+                cur.execute(DELETE_SQL, ('FLOW_TEST',))
                 conn.commit()
             else:
                 self.print_test("Data Flow", "WARN", 
                               "Data not found in database. Check if backend/simulate_sensors.py is running")
             
             cur.close()
-            conn.close()
+            conn.rollback()
             return True
             
         except Exception as e:
             self.print_test("Data Flow Test", "FAIL", str(e))
             return False
     
+    def _process_running(self, needle):
+        """Check if any process command line contains needle (bytes)"""
+        if not os.path.isdir('/proc'):
+            # No procfs (e.g. macOS): fall back to pgrep
+            result = subprocess.run(['pgrep', '-f', needle.decode()], capture_output=True)
+            return bool(result.stdout.strip())
+        
+        # Read /proc/<pid>/cmdline directly instead of forking pgrep
+        own_pid = str(os.getpid())
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit() or pid == own_pid:
+                continue
+            try:
+                with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                    if needle in f.read():
+                        return True
+            except OSError:
+                continue
+        return False
+    
     def test_backend_script(self):
         """Test if backend simulation script is configured"""
         self.print_header("Testing Backend Configuration")
         
-        import os
-        
         backend_path = os.path.expanduser("~/iot-monitoring/backend")
         simulate_script = os.path.join(backend_path, "simulate_sensors.py")
         
@@ -377,10 +602,7 @@ class SystemTester:
             
             # Check if script is running
             try:
-                import subprocess
-                result = subprocess.run(['pgrep', '-f', 'simulate_sensors.py'], 
-                                      capture_output=True, text=True)
-                if result.stdout.strip():
+                if self._process_running(b'simulate_sensors.py'):
                     self.print_test("Backend Process", "PASS", "simulate_sensors.py is running")
                 else:
                     self.print_test("Backend Process", "WARN", 
@@ -394,83 +616,116 @@ class SystemTester:
     
     def print_summary(self):
         """Print test summary"""
-        print(f"\n{BLUE}{'='*60}")
-        print("  TEST SUMMARY")
-        print(f"{'='*60}{RESET}\n")
+        self._out(f"\n{BLUE}{'='*60}")
+        self._out("  TEST SUMMARY")
+        self._out(f"{'='*60}{RESET}\n")
         
         total = self.passed + self.failed + self.warnings
         
-        print(f"{GREEN}Passed:{RESET}   {self.passed}/{total}")
-        print(f"{RED}Failed:{RESET}   {self.failed}/{total}")
-        print(f"{YELLOW}Warnings:{RESET} {self.warnings}/{total}")
+        self._out(f"{GREEN}Passed:{RESET}   {self.passed}/{total}")
+        self._out(f"{RED}Failed:{RESET}   {self.failed}/{total}")
+        self._out(f"{YELLOW}Warnings:{RESET} {self.warnings}/{total}")
         
         if self.failed == 0:
-            print(f"\n{GREEN}✓ System is operational!{RESET}")
+            self._out(f"\n{GREEN}✓ System is operational!{RESET}")
             return True
         else:
-            print(f"\n{RED}✗ System has issues that need attention.{RESET}")
+            self._out(f"\n{RED}✗ System has issues that need attention.{RESET}")
             return False
     
+    async def _run_checks(self):
+        """Run the checks as a dependency graph: independent ones concurrently, then data flow"""
+        # The independent checks mostly wait on sockets and subprocesses, so each
+        # runs in a worker thread; output is printed afterwards in the usual order
+        independent_tests = [
+            self.test_docker_containers,
+            self.test_mqtt_broker,
+            self.test_questdb,
+            self.test_grafana,
+            self.test_backend_script,
+        ]
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._run_buffered, test) for test in independent_tests)
+        )
+        for _, lines in results:
+            for line in lines:
+                self._out(line)
+        # results follow independent_tests: [1] is the broker check, [2] QuestDB
+        self._mqtt_ok = results[1][0]
+        self._qdb_ok = results[2][0]
+        
+        # Data flow depends on both MQTT and QuestDB, so it runs once they are done
+        await asyncio.to_thread(self.test_data_flow)
+    
     def run_all_tests(self):
         """Run all system tests"""
-        print(f"{BLUE}")
-        print("╔════════════════════════════════════════════════════════╗")
-        print("║     IoT Monitoring System - Integration Test          ║")
-        print("║     Testing all components in sequence                ║")
-        print("╚════════════════════════════════════════════════════════╝")
-        print(f"{RESET}")
+        self._out(f"{BLUE}")
+        self._out("╔════════════════════════════════════════════════════════╗")
+        self._out("║     IoT Monitoring System - Integration Test          ║")
+        self._out("║     Testing all components concurrently               ║")
+        self._out("╚════════════════════════════════════════════════════════╝")
+        self._out(f"{RESET}")
         
-        # Run tests in order
-        self.test_docker_containers()
-        self.test_mqtt_broker()
-        self.test_questdb()
-        self.test_grafana()
-        self.test_backend_script()
-        self.test_data_flow()
+        try:
+            # Probe all service ports in one go; the tests below reuse the results
+            self._port_status = self.check_ports_batch(PORT_TARGETS)
+            
+            asyncio.run(self._run_checks())
+        finally:
+            self._close_qdb()
+            self._close_mqtt()
         
         # Print summary
         success = self.print_summary()
         
         # Recommendations
         if self.failed > 0 or self.warnings > 0:
-            print(f"\n{YELLOW}RECOMMENDATIONS:{RESET}")
-            print("─" * 60)
+            self._out(f"\n{YELLOW}RECOMMENDATIONS:{RESET}")
+            self._out("─" * 60)
             
             if self.failed > 0:
-                print("\n1. Check Docker containers are running:")
-                print("   docker compose ps")
-                print("\n2. Restart failed services:")
-                print("   docker compose restart")
-                print("\n3. Check service logs:")
-                print("   docker logs mosquitto")
-                print("   docker logs questdb")
-                print("   docker logs grafana")
+                self._out("\n1. Check Docker containers are running:")
+                self._out("   docker compose ps")
+                self._out("\n2. Restart failed services:")
+                self._out("   docker compose restart")
+                self._out("\n3. Check service logs:")
+                self._out("   docker logs mosquitto")
+                self._out("   docker logs questdb")
+                self._out("   docker logs grafana")
             
             if self.warnings > 0:
-                print("\n4. Start backend simulation:")
-                print("   cd ~/iot-monitoring/backend")
-                print("   source venv/bin/activate")
-                print("   python3 simulate_sensors.py")
-                print("\n5. Verify Grafana datasource:")
-                print("   Open http://localhost:3000")
-                print("   Add QuestDB as PostgreSQL datasource")
+                self._out("\n4. Start backend simulation:")
+                self._out("   cd ~/iot-monitoring/backend")
+                self._out("   source venv/bin/activate")
+                self._out("   python3 simulate_sensors.py")
+                self._out("\n5. Verify Grafana datasource:")
+                self._out("   Open http://localhost:3000")
+                self._out("   Add QuestDB as PostgreSQL datasource")
         
-        print("\n" + "─" * 60 + "\n")
+        self._out("\n" + "─" * 60 + "\n")
         
+        self.flush_output()
         return success
 
 
 def main():
     """Main function"""
-    tester = SystemTester()
+    parser = argparse.ArgumentParser(description="IoT monitoring system integration test")
+    parser.add_argument("--stream", action="store_true",
+                        help="print results as they happen instead of all at the end")
+    args = parser.parse_args()
+    
+    tester = SystemTester(stream=args.stream)
     
     try:
         success = tester.run_all_tests()
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
+        tester.flush_output()
         print(f"\n{YELLOW}Test interrupted by user{RESET}")
         sys.exit(1)
     except Exception as e:
+        tester.flush_output()
         print(f"\n{RED}Unexpected error: {e}{RESET}")
         sys.exit(1)
 